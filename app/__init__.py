@@ -7,6 +7,7 @@ from .config import read_config, init_xslt, CONFIG
 from .view_static import static
 from .view_opds import opds
 from .data import genres_to_meta_init, meta_init
+from .db_classes import dbsession_remove
 
 CONFIG_FILE = "./config.ini"
 
@@ -24,6 +25,8 @@ def create_app():
     genres_to_meta_init()
     meta_init()
 
+    app.teardown_appcontext(dbsession_remove)
+
     app.register_blueprint(static, url_prefix=app.config['APPLICATION_ROOT'])
     app.register_blueprint(opds, url_prefix=app.config['APPLICATION_ROOT'])
 
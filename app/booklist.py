@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+"""booklists (.zip.list) reading/writing in jsonl and binary formats"""
+
+import os
+import base64
+import binascii
+import glob
+import gzip
+import json
+import zlib
+import struct
+import io
+import logging
+import queue
+import tempfile
+import threading
+import time
+
+try:
+    from compression import zstd  # python 3.14+
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .config import CONFIG
+
+# booklist suffixes by reading preference, only one booklist per .zip is used
+BOOKLIST_SUFFIXES = (".list", ".list.gz", ".list.zst", ".list.bin")
+BOOKLIST_FORMATS = {
+    "jsonl": ".list",
+    "gzip": ".list.gz",  # jsonl
+    "zstd": ".list.zst",  # jsonl, require python 3.14+ or zstandard module
+    "bin": ".list.bin"
+}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+COMPRESS_CHUNK = 1048576  # bytes of jsonl passed to compression thread at once
+COMPRESS_QUEUE = 4  # chunks waiting for compression
+
+# binary format: magic (with format version), then blocks of
+# (uint32 length, uint32 crc32 of data, data -- utf-8 json array of book records), integers are little endian;
+# one json.loads() per block is about twice faster than per jsonl line; booklist of other format version
+# (i.e. version 1 with marshal'ed blocks) is outdated and is rebuilt from .zip
+BIN_MAGIC = b"FB2LIST\x02"
+BIN_HEAD_FMT = struct.Struct("<II")
+BIN_BLOCK_RECORDS = 64  # records per block
+
+# covers sidecar (cover_sidecar = yes): raw cover previews of .zip books in <zip>.covers,
+# book record has {"content-type": .., "ref": [offset, length]} instead of base64 "data"
+COVERS_SUFFIX = ".covers"
+
+
+def booklist_base(booklist: str) -> str:
+    """.zip filename for booklist"""
+    for suffix in BOOKLIST_SUFFIXES:
+        if booklist.endswith(suffix):
+            return booklist[:-len(suffix)]
+    return booklist
+
+
+def find_booklist(zip_file: str):
+    """existing booklist for .zip or None"""
+    for suffix in BOOKLIST_SUFFIXES:
+        if os.path.exists(zip_file + suffix):
+            return zip_file + suffix
+    return None
+
+
+def booklists(zipdir: str):
+    """sorted booklists in zipdir, one (preferred by BOOKLIST_SUFFIXES) per .zip"""
+    zips = set()
+    for booklist in glob.glob(zipdir + '/*.zip.list*'):
+        zips.add(booklist_base(booklist))
+    ret = []
+    for zip_file in zips:
+        booklist = find_booklist(zip_file)
+        if booklist is not None:
+            ret.append(booklist)
+    return sorted(ret)
+
+
+def remove_other_booklists(zip_file: str, keep: str):
+    """remove booklists of .zip in other formats (i.e. old .list.gz after writing .list)"""
+    for suffix in BOOKLIST_SUFFIXES:
+        booklist = zip_file + suffix
+        if booklist != keep and os.path.exists(booklist):
+            os.remove(booklist)
+
+
+def booklist_supported(booklist: str) -> bool:
+    """booklist is in format, which can be read (binary one -- of current version)"""
+    if not booklist.endswith(".bin"):
+        return True
+    try:
+        with open(booklist, "rb") as data:
+            return data.read(len(BIN_MAGIC)) == BIN_MAGIC
+    except OSError:
+        return False
+
+
+def book_from_line(line):
+    """book struct from booklist line: jsonl string or already decoded record from binary booklist"""
+    if isinstance(line, str):
+        return json.loads(line)
+    return line
+
+
+def covers_sidecar(zip_file: str) -> str:
+    """covers sidecar filename for .zip"""
+    return zip_file + COVERS_SUFFIX
+
+
+class CoversReader:
+    """random access to covers sidecar of .zip, file is opened on first read"""
+
+    def __init__(self, zip_file):
+        self.filename = covers_sidecar(zip_file)
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """close sidecar file"""
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    def read(self, ref):
+        """image bytes by [offset, length] reference"""
+        if self.data is None:
+            self.data = open(self.filename, "rb")  # pylint: disable=R1732
+        offset, length = ref
+        self.data.seek(offset)
+        ret = self.data.read(length)
+        if len(ret) != length:
+            raise ValueError("short read of cover in %s" % self.filename)
+        return ret
+
+
+def cover_bytes(cover, covers: CoversReader):
+    """raw image bytes of book record cover (base64 "data" or sidecar "ref"), None if there is no image"""
+    if cover is None:
+        return None
+    if "ref" in cover:
+        return covers.read(cover["ref"])
+    return base64.b64decode(cover["data"])
+
+
+class BinBooklistReader:
+    """
+    reader for binary booklist with file-like interface used for jsonl:
+    iteration and readlines(hint) return decoded book records instead of strings
+    """
+
+    def __init__(self, booklist):
+        self.data = open(booklist, "rb")  # pylint: disable=R1732
+        magic = self.data.read(len(BIN_MAGIC))
+        if magic != BIN_MAGIC:
+            self.data.close()
+            raise ValueError("%s is not binary booklist of supported version, rebuild it" % booklist)
+        self.booklist = booklist
+        self.records = []
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """close booklist file"""
+        self.data.close()
+
+    def read_block(self):
+        """read next block of records, return size of block in bytes (0 at end)"""
+        head = self.data.read(BIN_HEAD_FMT.size)
+        if len(head) == 0:
+            return 0
+        if len(head) < BIN_HEAD_FMT.size:
+            raise ValueError("%s is truncated" % self.booklist)
+        length, crc = BIN_HEAD_FMT.unpack(head)
+        data = self.data.read(length)
+        if len(data) < length or zlib.crc32(data) != crc:
+            raise ValueError("%s is corrupted" % self.booklist)
+        self.records = json.loads(data)
+        self.pos = 0
+        return length
+
+    def __iter__(self):
+        while True:
+            if self.pos >= len(self.records) and self.read_block() == 0:
+                return
+            record = self.records[self.pos]
+            self.pos += 1
+            yield record
+
+    def readlines(self, hint=-1):
+        """return list of records, about `hint` bytes of booklist data"""
+        ret = self.records[self.pos:]
+        self.records = []
+        self.pos = 0
+        size = 0
+        while hint is None or hint <= 0 or size < hint:
+            length = self.read_block()
+            if length == 0:
+                break
+            size += length
+            ret.extend(self.records)
+            self.records = []
+        return ret
+
+
+def open_booklist(booklist):
+    """return file object of booklist (.zip.list, .zip.list.gz, .zip.list.zst or .zip.list.bin)"""
+    if booklist.endswith(".bin"):
+        return BinBooklistReader(booklist)
+    if booklist.endswith(".gz"):
+        return gzip.open(booklist, mode='rt', encoding='utf-8')
+    if booklist.endswith(".zst"):
+        return io.TextIOWrapper(zstd_open(booklist, "rb"), encoding="utf-8")
+    return open(booklist, encoding="utf-8")  # pylint: disable=R1732
+
+
+def zstd_available() -> bool:
+    """zstd compression is supported by stdlib or zstandard module"""
+    return zstd is not None or zstandard is not None
+
+
+def zstd_open(filename, mode):
+    """open .zst file in binary mode"""
+    if zstd is not None:
+        if mode.startswith("w"):
+            return zstd.open(filename, mode, level=ZSTD_LEVEL)
+        return zstd.open(filename, mode)
+    if zstandard is not None:
+        if mode.startswith("w"):
+            # compression by zstd worker threads
+            return zstandard.open(filename, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1))
+        return zstandard.open(filename, mode)
+    raise RuntimeError("zstd is not supported: python 3.14+ or zstandard module required")
+
+
+def open_compressed(filename, fmt):
+    """open compressed file for binary writing"""
+    if fmt == "gzip":
+        return gzip.open(filename, "wb", compresslevel=GZIP_LEVEL)
+    return zstd_open(filename, "wb")
+
+
+class CompressedWriter:
+    """
+    text file-like object for writing, data is compressed and written to file in background thread,
+    so compression overlaps with books parsing (zlib and zstd release GIL)
+    """
+
+    def __init__(self, filename, fmt):
+        self.queue = queue.Queue(maxsize=COMPRESS_QUEUE)
+        self.buf = []
+        self.size = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=(open_compressed(filename, fmt),), daemon=True)
+        self.thread.start()
+
+    def run(self, out):
+        """
+        compression thread, first error of writing, flushing or closing (compressed stream trailer)
+        is kept for close()
+        """
+        try:
+            with out:
+                while True:
+                    data = self.queue.get()
+                    if data is None:
+                        break
+                    if self.error is not None:
+                        continue  # drain queue after error
+                    try:
+                        out.write(data)
+                    except Exception as ex:  # pylint: disable=W0703
+                        self.error = ex
+        except Exception as ex:  # pylint: disable=W0703
+            if self.error is None:
+                self.error = ex
+
+    def write(self, text: str):
+        """add text to buffer, pass buffer to compression thread if it is big enough"""
+        self.buf.append(text)
+        self.size += len(text)
+        if self.size >= COMPRESS_CHUNK:
+            self.flush()
+
+    def flush(self):
+        """pass buffered text to compression thread"""
+        if self.error is not None:
+            raise self.error
+        if len(self.buf) > 0:
+            self.queue.put("".join(self.buf).encode("utf-8"))
+            self.buf = []
+            self.size = 0
+
+    def close(self):
+        """write rest of data, wait for compression thread, raise its error (so booklist is not committed)"""
+        if self.thread.is_alive():
+            try:
+                self.flush()
+            finally:
+                self.queue.put(None)
+                self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class BooklistWriter:
+    """
+    write booklist for .zip to temporary file, commit() replace existing booklist atomically,
+    write() accept book struct or jsonl string
+    """
+
+    def __init__(self, zip_file, fmt="jsonl", covers=False, source_zip=None):
+        """
+        covers: write cover images to sidecar instead of base64 in records,
+        source_zip: .zip, which sidecar is referenced by written records (default: zip_file)
+        """
+        if fmt not in BOOKLIST_FORMATS:
+            raise ValueError("unknown booklist format: %s" % fmt)
+        self.zip_file = zip_file
+        self.fmt = fmt
+        self.booklist = zip_file + BOOKLIST_FORMATS[fmt]
+        self.tmpfile = self.booklist + ".tmp"
+        self.block = []
+        self.source_covers = CoversReader(source_zip if source_zip is not None else zip_file)
+        self.covers = None
+        self.covers_tmpfile = covers_sidecar(zip_file) + ".tmp"
+        if covers:
+            self.covers = open(self.covers_tmpfile, "wb")  # pylint: disable=R1732
+        if fmt == "bin":
+            self.data = open(self.tmpfile, "wb")  # pylint: disable=R1732
+            self.data.write(BIN_MAGIC)
+        elif fmt in ("gzip", "zstd"):
+            self.data = CompressedWriter(self.tmpfile, fmt)
+        else:
+            self.data = open(self.tmpfile, "w", encoding="utf-8")  # pylint: disable=R1732
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self.abort()
+
+    def write(self, book):
+        """add book record to booklist"""
+        if isinstance(book, str) and '"cover"' in book and (self.covers is not None or '"ref"' in book):
+            book = book_from_line(book)
+        if not isinstance(book, str):
+            book = self.convert_cover(book)
+        if self.fmt == "bin":
+            self.block.append(book_from_line(book))
+            if len(self.block) >= BIN_BLOCK_RECORDS:
+                self.write_block()
+        else:
+            if not isinstance(book, str):
+                book = json.dumps(book, ensure_ascii=False)
+            self.data.write(book)  # jsonl
+            self.data.write("\n")
+
+    def convert_cover(self, book):
+        """move cover of record to sidecar or back to base64 data, as sidecar is used for this booklist"""
+        cover = book.get("cover")
+        if cover is None or (self.covers is None and "ref" not in cover):
+            return book
+        try:
+            data = cover_bytes(cover, self.source_covers)
+        except (OSError, ValueError, binascii.Error) as ex:
+            logging.error("cover of %s/%s is lost: %s", book.get("zipfile"), book.get("filename"), ex)
+            return dict(book, cover=None)
+        if self.covers is not None:
+            offset = self.covers.tell()
+            self.covers.write(data)
+            cover = {"content-type": cover.get("content-type"), "ref": [offset, len(data)]}
+        else:
+            cover = {"content-type": cover.get("content-type"), "data": base64.b64encode(data).decode("utf-8")}
+        return dict(book, cover=cover)
+
+    def write_block(self):
+        """write collected records as one block"""
+        if len(self.block) == 0:
+            return
+        data = json.dumps(self.block, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.data.write(BIN_HEAD_FMT.pack(len(data), zlib.crc32(data)))
+        self.data.write(data)
+        self.block = []
+
+    def commit(self):
+        """finish writing, replace booklist and remove booklists of .zip in other formats"""
+        if self.fmt == "bin":
+            self.write_block()
+        self.data.close()
+        self.source_covers.close()
+        if self.covers is not None:
+            self.covers.close()
+            os.replace(self.covers_tmpfile, covers_sidecar(self.zip_file))
+        elif os.path.exists(covers_sidecar(self.zip_file)):
+            os.remove(covers_sidecar(self.zip_file))  # covers are in records now
+        os.replace(self.tmpfile, self.booklist)
+        remove_other_booklists(self.zip_file, self.booklist)
+        return self.booklist
+
+    def abort(self):
+        """drop incomplete booklist"""
+        try:
+            self.data.close()
+        except Exception as ex:  # pylint: disable=W0703
+            logging.debug("error on closing %s: %s", self.tmpfile, ex)
+        self.source_covers.close()
+        if self.covers is not None:
+            self.covers.close()
+        for tmpfile in (self.tmpfile, self.covers_tmpfile):
+            if os.path.exists(tmpfile):
+                logging.info("removing %s", tmpfile)
+                os.remove(tmpfile)
+
+
+def copy_booklist(booklist, zip_file, fmt):
+    """write records of booklist to booklist for zip_file in format, return new booklist filename"""
+    source_zip = booklist_base(booklist)
+    covers = os.path.exists(covers_sidecar(source_zip))  # keep covers where they are
+    with open_booklist(booklist) as src, BooklistWriter(zip_file, fmt, covers, source_zip) as dst:
+        for line in src:
+            if isinstance(line, str):
+                line = line.rstrip("\n")
+                if line.strip() == "":
+                    continue
+            dst.write(line)
+        return dst.commit()
+
+
+def convert_booklist(booklist, fmt):
+    """convert booklist to format, return new booklist filename"""
+    return copy_booklist(booklist, booklist_base(booklist), fmt)
+
+
+def convert_lists(fmt):
+    """convert all booklists in zips dir to format"""
+    logging.info("Converting booklists to %s", fmt)
+    for booklist in booklists(CONFIG['ZIPS']):
+        if booklist == booklist_base(booklist) + BOOKLIST_FORMATS[fmt]:
+            continue
+        logging.info("%s", booklist)
+        convert_booklist(booklist, fmt)
+    logging.info("[end]")
+
+
+def read_all(booklist):
+    """read and decode every record of booklist, return records count"""
+    count = 0
+    with open_booklist(booklist) as lst:
+        lines = lst.readlines(int(CONFIG['PASS_SIZE_HINT']))
+        while len(lines) > 0:
+            for line in lines:
+                book_from_line(line)
+                count += 1
+            lines = lst.readlines(int(CONFIG['PASS_SIZE_HINT']))
+    return count
+
+
+def bench_formats():
+    """booklist formats, supported in this environment"""
+    return [fmt for fmt in BOOKLIST_FORMATS if fmt != "zstd" or zstd_available()]
+
+
+def bench_lists(formats=None):
+    """
+    compare size, write and read time of booklists in formats,
+    return {format: {"size": ..., "books": ..., "write": seconds, "read": seconds}}
+    """
+    if formats is None:
+        formats = bench_formats()
+    ret = {fmt: {"size": 0, "books": 0, "write": 0.0, "read": 0.0} for fmt in formats}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for booklist in booklists(CONFIG['ZIPS']):
+            zip_file = booklist_base(booklist)
+            for fmt in formats:
+                start = time.perf_counter()
+                converted = copy_booklist(booklist, os.path.join(tmpdir, os.path.basename(zip_file)), fmt)
+                ret[fmt]["write"] += time.perf_counter() - start
+                start = time.perf_counter()
+                ret[fmt]["books"] += read_all(converted)
+                ret[fmt]["read"] += time.perf_counter() - start
+                ret[fmt]["size"] += os.path.getsize(converted)
+                os.remove(converted)
+    logging.info("%-6s %12s %9s %9s %12s %10s", "format", "bytes", "write, s", "read, s", "books/s", "MB/s")
+    for fmt in formats:
+        res = ret[fmt]
+        rate = res["books"] / res["read"] if res["read"] > 0 else 0
+        mbps = res["size"] / res["read"] / 1048576 if res["read"] > 0 else 0
+        logging.info(
+            "%-6s %12s %9.3f %9.3f %12.1f %10.1f", fmt, res["size"], res["write"], res["read"], rate, mbps
+        )
+    return ret
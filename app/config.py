@@ -19,6 +19,10 @@ VARS = {
     "pg_host": "PG_HOST",  # postgres host
     "pg_pass": "PG_PASS",  # postgres password
     "pg_user": "PG_USER",  # postgres username
+    "db_pool_size": "DB_POOL_SIZE",  # connections kept in pool of every process
+    "db_pool_overflow": "DB_POOL_OVERFLOW",  # extra connections over pool size at peak
+    "db_pool_recycle": "DB_POOL_RECYCLE",  # seconds, reconnect older connections
+    "db_maintenance_mem": "DB_MAINTENANCE_MEM",  # maintenance_work_mem for rebuild of deferred indexes
     "listen_port": "LISTEN_PORT",  # ex: "8000"
     "listen_host": "LISTEN_HOST",  # ex: "0.0.0.0"
     "pic_width": "PIC_WIDTH",  # max width for cover previews (see 'datachew.sh cover' command)
@@ -41,6 +45,13 @@ VARS = {
     "new_window": "NEW_WINDOW",  # true if book links open in new window
     "openai_model": "OPENAI_MODEL",  # by default 'text-embedding-3-small'
     "openai_key": "OPENAI_KEY",  # does not need for ollama
+    "book_jobs": "BOOK_JOBS",  # worker processes for parsing books inside of one .zip
+    "thumb_jobs": "THUMB_JOBS",  # threads for making cover previews, 0 -- make previews while parsing
+    "book_timeout": "BOOK_TIMEOUT",  # seconds for parsing one book in supervised worker, 0 -- no limit
+    "book_memory_mb": "BOOK_MEMORY_MB",  # address space limit of supervised worker, 0 -- no limit
+    "list_format": "LIST_FORMAT",  # jsonl (.zip.list), gzip (.list.gz), zstd (.list.zst) or bin (.zip.list.bin)
+    "cover_store": "COVER_STORE",  # files (one .jpg per image) or pack (covers/<aa>.pack + .idx)
+    "cover_sidecar": "COVER_SIDECAR",  # yes|no -- raw cover previews in <zip>.covers instead of base64 in .list
 }
 
 CONFIG = {  # default values
@@ -67,6 +78,17 @@ CONFIG = {  # default values
     "OPENAI_URL": "http://localhost:18000/v1",
     "OPENAI_MODEL": "text-embedding-3-small",
     "OPENAI_KEY": "-",  # no keys for ollama
+    "BOOK_JOBS": "1",  # parse books of .zip in main process
+    "THUMB_JOBS": "2",
+    "BOOK_TIMEOUT": "0",
+    "BOOK_MEMORY_MB": "0",
+    "LIST_FORMAT": "jsonl",
+    "DB_POOL_SIZE": "5",
+    "DB_POOL_OVERFLOW": "10",
+    "DB_POOL_RECYCLE": "1800",
+    "DB_MAINTENANCE_MEM": "256MB",
+    "COVER_STORE": "files",
+    "COVER_SIDECAR": "no",
 }
 
 # internal configuration for opds interface
@@ -93,6 +115,7 @@ URL = {
     "dl": "/fb2/",  # download book
     "plain": "/plain/",  # read via browser xsl processing
     "cover": "/books/",  # books cover images
+    "covers": "/covers/",  # covers store in pages_path, by image hash (see app/covers.py)
     "xsl_read": "/fb2.xsl",  # xsl for browser processing
 }
 
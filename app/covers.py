@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""content-addressed covers store: one file per unique image, books refer it by cover_id"""
+
+import os
+import json
+import glob
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+
+from functools import lru_cache
+
+from .config import CONFIG, URL
+from .strings import id2path
+
+COVER_REFS_CACHE = 65536  # book_id -> cover_id resolved in web process
+
+# cover_id's already written/checked in this process
+COVERS_SEEN = set()
+
+# packed store (cover_store = pack): covers/<aa>.pack with images and append-only covers/<aa>.idx,
+# where <aa> is first chars of cover_id; index record is (md5 digest, offset in .pack, length)
+COVER_PACK_BUCKET = 2
+COVER_INDEX_REC = struct.Struct("<16sQI")
+PACK_SYNC_COVERS = 10000  # covers moved to packs between fsync of packs and removing loose files
+
+# bucket -> {"index": {cover_id: (offset, length)}, "idx_size": .., "pack": file, "mmap": mmap or None}
+PACKS = {}
+PACKS_LOCK = threading.Lock()  # web threads share PACKS
+
+
+def make_cover_id(img_bytes: bytes) -> str:
+    """cover_id is md5 of image data"""
+    return hashlib.md5(img_bytes).hexdigest()
+
+
+def cover_path(pagesdir: str, cover_id: str) -> str:
+    """filesystem path of cover in store"""
+    return pagesdir + URL["covers"] + id2path(cover_id) + ".jpg"
+
+
+def loose_cover(pagesdir: str, cover_id: str):
+    """filesystem path of cover in loose files store or None"""
+    path = cover_path(pagesdir, cover_id)
+    if os.path.isfile(path):
+        return path
+    return None
+
+
+def pack_path(pagesdir: str, bucket: str, ext: str) -> str:
+    """filesystem path of bucket .pack or .idx"""
+    return pagesdir + URL["covers"] + bucket + ext
+
+
+def pack_store_enabled() -> bool:
+    """covers are written to/served from packs"""
+    return CONFIG.get('COVER_STORE', "files") == "pack"
+
+
+def store_cover(pagesdir: str, img_bytes: bytes) -> str:
+    """write image to store if there is no the same image yet, return cover_id"""
+    cover_id = make_cover_id(img_bytes)
+    if cover_id in COVERS_SEEN:
+        return cover_id
+    if pack_store_enabled():
+        store_cover_pack(pagesdir, cover_id, img_bytes)
+    else:
+        path = cover_path(pagesdir, cover_id)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = "%s.%s.tmp" % (path, os.getpid())
+            with open(tmp_path, "wb") as img:
+                img.write(img_bytes)
+            os.replace(tmp_path, path)
+    COVERS_SEEN.add(cover_id)
+    return cover_id
+
+
+def load_pack(pagesdir: str, bucket: str):
+    """return cached pack of bucket with index updated from .idx tail, None if there is no pack"""
+    idx_file = pack_path(pagesdir, bucket, ".idx")
+    try:
+        idx_size = os.stat(idx_file).st_size
+    except OSError:
+        return None
+    idx_size -= idx_size % COVER_INDEX_REC.size  # record may be written just now
+    pack = PACKS.get(bucket)
+    if pack is None:
+        pack = {"index": {}, "idx_size": 0, "pack": None, "mmap": None}
+        PACKS[bucket] = pack
+    if idx_size > pack["idx_size"]:
+        with open(idx_file, "rb") as idx:
+            idx.seek(pack["idx_size"])
+            data = idx.read(idx_size - pack["idx_size"])
+        for digest, offset, length in COVER_INDEX_REC.iter_unpack(data):
+            pack["index"][digest.hex()] = (offset, length)
+        pack["idx_size"] = idx_size
+    return pack
+
+
+def pack_data(pagesdir: str, bucket: str, pack, offset: int, length: int):
+    """image bytes from memory-mapped .pack, mapping is renewed when pack is grown"""
+    mapped = pack["mmap"]
+    if mapped is None or offset + length > len(mapped):
+        if mapped is not None:
+            mapped.close()
+            pack["pack"].close()
+        pack["pack"] = open(pack_path(pagesdir, bucket, ".pack"), "rb")  # pylint: disable=R1732
+        pack["mmap"] = mmap.mmap(pack["pack"].fileno(), 0, access=mmap.ACCESS_READ)
+        mapped = pack["mmap"]
+        if offset + length > len(mapped):
+            return None
+    return mapped[offset:offset + length]
+
+
+def read_packed_cover(pagesdir: str, cover_id: str):
+    """image bytes from packed store or None"""
+    bucket = cover_id[:COVER_PACK_BUCKET]
+    with PACKS_LOCK:
+        pack = load_pack(pagesdir, bucket)
+        if pack is None or cover_id not in pack["index"]:
+            return None
+        offset, length = pack["index"][cover_id]
+        try:
+            return pack_data(pagesdir, bucket, pack, offset, length)
+        except (OSError, ValueError) as ex:
+            logging.error("can't read cover %s from pack: %s", cover_id, ex)
+            return None
+
+
+def store_cover_pack(pagesdir: str, cover_id: str, img_bytes: bytes):
+    """append image to bucket .pack and its record to .idx (image first, so index never points to nothing)"""
+    bucket = cover_id[:COVER_PACK_BUCKET]
+    pack = load_pack(pagesdir, bucket)
+    if pack is not None and cover_id in pack["index"]:
+        return
+    os.makedirs(pagesdir + URL["covers"], exist_ok=True)
+    with open(pack_path(pagesdir, bucket, ".pack"), "ab") as data:
+        offset = data.tell()
+        data.write(img_bytes)
+    with open(pack_path(pagesdir, bucket, ".idx"), "ab") as idx:
+        idx.write(COVER_INDEX_REC.pack(bytes.fromhex(cover_id), offset, len(img_bytes)))
+
+
+def sync_packs(pagesdir: str, buckets):
+    """fsync .pack and .idx of buckets (before loose files, which are in them now, are removed)"""
+    for bucket in sorted(buckets):
+        for ext in (".pack", ".idx"):
+            with open(pack_path(pagesdir, bucket, ext), "rb") as data:
+                os.fsync(data.fileno())
+
+
+def pack_covers(pagesdir: str):
+    """move covers from loose files store to packs, loose files are removed after packs are synced to disk"""
+    count = 0
+    moved = []
+    paths = sorted(glob.glob(pagesdir + URL["covers"] + "*/*/*.jpg"))
+    for num, path in enumerate(paths, start=1):
+        cover_id = os.path.basename(path)[:-4]
+        with open(path, "rb") as img:
+            store_cover_pack(pagesdir, cover_id, img.read())
+        moved.append(path)
+        if len(moved) >= PACK_SYNC_COVERS or num == len(paths):
+            sync_packs(pagesdir, {os.path.basename(moved_path)[:COVER_PACK_BUCKET] for moved_path in moved})
+            for moved_path in moved:
+                os.unlink(moved_path)
+            count = count + len(moved)
+            moved = []
+            logging.debug("   %s", count)
+    for subdir in sorted(glob.glob(pagesdir + URL["covers"] + "*/*/"), reverse=True) + \
+            sorted(glob.glob(pagesdir + URL["covers"] + "*/")):
+        try:
+            os.rmdir(subdir)
+        except OSError:
+            pass  # not empty
+    logging.info("%s covers moved to packs", count)
+
+
+@lru_cache(maxsize=COVER_REFS_CACHE)
+def book_cover_id(book_json: str, mtime_ns: int):  # pylint: disable=W0613
+    """cover_id from book .json (cached while .json is not changed) or None"""
+    try:
+        with open(book_json, encoding="utf-8") as data:
+            return json.load(data).get("cover_id")
+    except (OSError, ValueError):
+        return None
+
+
+def find_cover(pagesdir: str, book_id: str):
+    """
+    return (etag, filesystem path or image bytes) of cover for book or None:
+    cover from store (packed, if enabled, or loose file) by cover_id in book .json,
+    or legacy <book_id>.jpg near it
+    """
+    book_base = pagesdir + URL["cover"] + id2path(book_id)
+    try:
+        mtime_ns = os.stat(book_base + ".json").st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    if mtime_ns is not None:
+        cover_id = book_cover_id(book_base + ".json", mtime_ns)
+        if cover_id is not None:
+            # store of other mode is looked too (i.e. covers are packed, but cover_store is not switched yet)
+            lookups = (read_packed_cover, loose_cover)
+            if not pack_store_enabled():
+                lookups = (loose_cover, read_packed_cover)
+            for lookup in lookups:
+                found = lookup(pagesdir, cover_id)
+                if found is not None:
+                    return cover_id, found
+    if os.path.isfile(book_base + ".jpg"):
+        return book_id, book_base + ".jpg"
+    return None
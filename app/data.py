@@ -1,26 +1,26 @@
 # -*- coding: utf-8 -*-
 """in-vars data manipulations"""
 
-import gzip
 import base64
 import logging
 import urllib
 
-from sqlalchemy.orm import sessionmaker
 from bs4 import BeautifulSoup
 import openai
 
 from .config import CONFIG, VECTOR_SIZE
 from .strings import make_id
+from .booklist import open_booklist  # noqa: F401 pylint: disable=W0611
 from .db_classes import (
     BookAuthor,
     BookSequence,
     BookGenre,
     Book,
     BookDescription,
+    BookAuthorLink,
+    BookSequenceLink,
     VectorsData,
-    VectorType,
-    dbconnect
+    VectorType
 )
 
 alphabet_1 = [  # first letters in main authors/sequences page
@@ -38,6 +38,9 @@ alphabet_2 = [  # second letters in main authors/sequences page
 genres = {}
 genres_meta = {}
 
+EXIST_QUERY_CHUNK = 10000  # ids in one IN query of existence check
+SEQ_NUM_MAX = 2147483647  # book_sequences.num is integer
+
 
 def cmp_in_arr(arr, char1, char2):
     """compare characters by array"""
@@ -160,49 +163,31 @@ def get_meta_name(meta_id):
     return meta_id
 
 
-def get_exist_authors(author_ids):
-    """return authors ids, which exists in database"""
-    ret = []
-    engine = dbconnect()
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    data = session.query(BookAuthor).filter(BookAuthor.id.in_(author_ids)).all()
-    for auth in data:
-        auth_id = auth.id
-        if auth_id in author_ids:
-            ret.append(auth_id)
-    session.close()
+def get_exist_ids(session, column, ids):
+    """return set of ids, which exists in database, by one IN query per EXIST_QUERY_CHUNK ids"""
+    ret = set()
+    ids = list(ids)
+    for pos in range(0, len(ids), EXIST_QUERY_CHUNK):
+        data = session.query(column).filter(column.in_(ids[pos:pos + EXIST_QUERY_CHUNK])).all()
+        for row in data:
+            ret.add(row[0])
     return ret
 
 
-def get_exist_seqs(seq_ids):
-    """return sequences ids, which exists in database"""
-    ret = []
-    engine = dbconnect()
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    data = session.query(BookSequence).filter(BookSequence.id.in_(seq_ids)).all()
-    for seq in data:
-        seq_id = seq.id
-        if seq_id in seq_ids:
-            ret.append(seq_id)
-    session.close()
-    return ret
+def drop_existing(session, column, data):
+    """return data dict without keys, which exists in database as column"""
+    if len(data) == 0:
+        return data
+    exist = get_exist_ids(session, column, data.keys())
+    return {key: val for key, val in data.items() if key not in exist}
 
 
 def fill_authors_book(authors, book):
-    """return array of BookAuthor objects for given book"""
-    authors_tmp = {}
-    auth_ids_tmp = []
+    """add authors of given book to authors dict (id: name), see drop_existing()"""
     if book is None or "authors" not in book or book["authors"] is None or len(book["authors"]) < 1:
         return authors
     for author in book["authors"]:
-        authors_tmp[author["id"]] = author["name"]
-        auth_ids_tmp.append(author["id"])
-    new_author_ids = get_exist_authors(auth_ids_tmp)
-    for auth_id in auth_ids_tmp:
-        if auth_id not in new_author_ids:
-            authors[auth_id] = authors_tmp[auth_id]
+        authors[author["id"]] = author["name"]
     return authors
 
 
@@ -221,19 +206,12 @@ def make_authors_db(authors):
 
 
 def fill_sequences_book(seqs, book):
-    """return array of BookSequence objects for given book"""
-    seqs_tmp = {}
-    seq_ids_tmp = []
+    """add sequences of given book to seqs dict (id: name), see drop_existing()"""
     if book is None or "sequences" not in book or book["sequences"] is None or len(book["sequences"]) < 1:
         return seqs
     for seq in book["sequences"]:
         if "id" in seq and seq["id"] is not None and "name" in seq and seq["name"] is not None:
-            seqs_tmp[seq["id"]] = seq["name"]
-            seq_ids_tmp.append(seq["id"])
-    new_seq_ids = get_exist_seqs(seq_ids_tmp)
-    for seq_id in seq_ids_tmp:
-        if seq_id not in new_seq_ids:
-            seqs[seq_id] = seqs_tmp[seq_id]
+            seqs[seq["id"]] = seq["name"]
     return seqs
 
 
@@ -251,34 +229,12 @@ def make_seqs_db(seqs):
     return ret
 
 
-def get_exist_genres(genre_ids):
-    """return genres ids, which exists in database"""
-    ret = []
-    engine = dbconnect()
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    data = session.query(BookGenre).filter(BookGenre.id.in_(genre_ids)).all()
-    for genre in data:
-        genre_id = genre.id
-        if genre_id in genre_ids:
-            ret.append(genre_id)
-    session.close()
-    return ret
-
-
 def fill_genres_book(genres, book):
-    """return array of BookGenre objects for given book"""
-    genres_tmp = {}
-    genre_ids_tmp = []
+    """add genres of given book to genres dict (id: 1), see drop_existing()"""
     if book is None or "genres" not in book or book["genres"] is None or len(book["genres"]) < 1:
         return genres
     for genre in book["genres"]:
-        genres_tmp[genre] = 1
-        genre_ids_tmp.append(genre)
-    new_genre_ids = get_exist_genres(genre_ids_tmp)
-    for genre_id in genre_ids_tmp:
-        if genre_id not in new_genre_ids:
-            genres[genre_id] = genres_tmp[genre_id]
+        genres[genre] = 1
     return genres
 
 
@@ -299,26 +255,9 @@ def make_genres_db(genre_ids):
     return ret
 
 
-def get_exists_book(book_ids):
-    """return book ids, which exists in database"""
-    ret = []
-    engine = dbconnect()
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    data = session.query(Book).filter(Book.book_id.in_(book_ids)).all()
-    for book in data:
-        book_id = book.book_id
-        if book_id in book_ids:
-            ret.append(book_id)
-    session.close()
-    return ret
-
-
 def fill_books(books, book):
-    """append new-only book to books"""
-    new_book_ids = get_exists_book([book["book_id"]])
-    if new_book_ids is None or len(new_book_ids) < 1:
-        books[book["book_id"]] = book
+    """append book to books, see drop_existing()"""
+    books[book["book_id"]] = book
     return books
 
 
@@ -354,6 +293,42 @@ def make_books_db(books):
     return ret
 
 
+def make_book_authors_db(books):
+    """return array of BookAuthorLink objects (one per book and author)"""
+    ret = []
+    for book_id in books:
+        if book_id is not None and books[book_id] is not None:
+            book = books[book_id]
+            if "authors" not in book or book["authors"] is None:
+                continue
+            author_ids = set()
+            for auth in book["authors"]:
+                if auth["id"] not in author_ids:
+                    author_ids.add(auth["id"])
+                    ret.append(BookAuthorLink(book_id=book_id, author_id=auth["id"]))
+    return ret
+
+
+def make_book_seqs_db(books):
+    """return array of BookSequenceLink objects (one per book and sequence, first number is kept)"""
+    ret = []
+    for book_id in books:
+        if book_id is not None and books[book_id] is not None:
+            book = books[book_id]
+            if "sequences" not in book or book["sequences"] is None:
+                continue
+            seq_ids = set()
+            for seq in book["sequences"]:
+                if "id" not in seq or seq["id"] is None or seq["id"] in seq_ids:
+                    continue
+                seq_ids.add(seq["id"])
+                num = seq.get("num")
+                if not isinstance(num, int) or num < 0 or num > SEQ_NUM_MAX:
+                    num = None  # no or invalid number
+                ret.append(BookSequenceLink(book_id=book_id, seq_id=seq["id"], num=num))
+    return ret
+
+
 def make_book_descr_db(books):
     """return array of BookDescription objects"""
     ret = []
@@ -375,14 +350,6 @@ def make_book_descr_db(books):
     return ret
 
 
-def open_booklist(booklist):
-    """return file object of booklist (.zip.list or .zip.list.gz)"""
-    if booklist.find('gz') >= len(booklist) - 3:  # pylint: disable=R1705
-        return gzip.open(booklist, mode='rt', encoding='utf-8')
-    else:
-        return open(booklist, encoding="utf-8")
-
-
 def seqs_in_data(data):
     """return [{"name": "...", "id": "...", "cnt": 1}, ...]"""
     ret = []
@@ -2,10 +2,22 @@
 """database initialization and some utilities"""
 
 import logging
-
-from sqlalchemy import text, select
-
-from .db_classes import Base, dbconnect, BookAuthor, BookDescription, BookSequence, BookGenre, GenresMeta, VectorsData
+import random
+
+from sqlalchemy import text, select, inspect
+
+from .db_classes import (
+    Base,
+    dbconnect,
+    Book,
+    BookAuthor,
+    BookDescription,
+    BookSequence,
+    BookSequenceLink,
+    BookGenre,
+    GenresMeta,
+    VectorsData
+)
 from .config import CONFIG
 from .db_fill import fill_genres_meta
 
@@ -28,6 +40,14 @@ def dbtables():
         Base.metadata.remove(vectors)
 
     Base.metadata.create_all(engine)
+    # create_all() skips existing tables, so add indexes, which appeared in them later
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        exist = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in exist:
+                logging.info("creating index %s", index.name)
+                index.create(bind=engine, checkfirst=True)
     fill_genres_meta()
     logging.info('end')
 
@@ -114,6 +134,41 @@ def get_seqs(session, seqids):
     return ret
 
 
+def get_books_seqs(session, bookids):
+    """return dict for: book_id: [{"id": seq_id, "num": number in sequence or None}, ...] from links"""
+    ret = {}
+    data = session.query(BookSequenceLink).filter(
+        BookSequenceLink.book_id.in_(bookids)
+    ).order_by(BookSequenceLink.book_id, BookSequenceLink.num).all()
+    for link in data:
+        ret.setdefault(link.book_id, []).append({
+            "id": link.seq_id,
+            "num": link.num
+        })
+    return ret
+
+
+def get_random_books(session, limit, gen_id=None):
+    """
+    return up to limit random books (of genre, by gin index): books from random point of book_id
+    in primary key order, wrapped to start of key if there is not enough books after it;
+    book_id is md5, so neighbours in key are random books, and no ORDER BY random() over all books is needed
+    """
+    anchor = "%032x" % random.getrandbits(128)
+    conditions = []
+    if gen_id is not None:
+        conditions.append(Book.genres.contains([gen_id]))
+    ret = session.query(Book).filter(
+        Book.book_id >= anchor, *conditions
+    ).order_by(Book.book_id).limit(limit).all()
+    if len(ret) < limit:
+        ret.extend(session.query(Book).filter(
+            Book.book_id < anchor, *conditions
+        ).order_by(Book.book_id).limit(limit - len(ret)).all())
+    random.shuffle(ret)
+    return ret
+
+
 def get_ids_nearest(session, vector, type, limit):
     """return array of ids"""
     ret = []
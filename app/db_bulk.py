@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""bulk load of booklists to database: COPY to unlogged staging tables, then merge to main tables"""
+
+import io
+import logging
+import time
+
+from contextlib import contextmanager
+from sqlalchemy import text, inspect
+
+from .config import CONFIG
+from .db_classes import (
+    Base,
+    Book,
+    BookDescription,
+    BookAuthorLink,
+    BookSequenceLink,
+    BookGenre,
+    BookSequence,
+    BookAuthor,
+    VectorsData,
+    dbconnect
+)
+from .data import (
+    fill_authors_book,
+    fill_sequences_book,
+    fill_genres_book,
+    fill_books,
+    make_authors_db,
+    make_seqs_db,
+    make_genres_db,
+    make_books_db,
+    make_book_descr_db,
+    make_book_authors_db,
+    make_book_seqs_db
+)
+from .trace import stage
+
+# main tables in merge order (book_descr and link tables refer books)
+BULK_TABLES = (Book, BookDescription, BookAuthorLink, BookSequenceLink, BookGenre, BookSequence, BookAuthor)
+STAGING_PREFIX = "staging_"
+# search indexes, which are expensive to maintain on every insert (see deferred_indexes())
+DEFERRED_INDEX_TYPES = ("gin", "hnsw")
+# tables loaded by commands, only their indexes are deferred
+FILL_TABLES = (Book, BookDescription, BookAuthor, BookSequence)
+VECTORS_TABLES = (VectorsData,)
+
+
+def staging_table(obj, suffix: str = "") -> str:
+    """staging table name for ORM class (suffix is used by parallel workers)"""
+    return STAGING_PREFIX + obj.__tablename__ + suffix
+
+
+def table_columns(obj):
+    """quoted column names of ORM class table"""
+    return ['"%s"' % col.name for col in obj.__table__.columns]
+
+
+def column_value(obj, col):
+    """attribute value of ORM object with python-side column default (not applied without ORM insert)"""
+    val = getattr(obj, col.name)
+    if val is None and col.default is not None and col.default.is_scalar:
+        val = col.default.arg
+    return val
+
+
+def row_dicts(objs):
+    """column dicts from ORM objects"""
+    ret = []
+    for obj in objs:
+        ret.append({col.name: column_value(obj, col) for col in obj.__table__.columns})
+    return ret
+
+
+def array_literal(vals) -> str:
+    """postgres array literal for list of strings"""
+    items = []
+    for val in vals:
+        if val is None:
+            items.append("NULL")
+        else:
+            items.append('"' + str(val).replace("\\", "\\\\").replace('"', '\\"') + '"')
+    return "{" + ",".join(items) + "}"
+
+
+def csv_value(val) -> str:
+    """value in COPY csv format, unquoted empty is NULL"""
+    if val is None:
+        return ""
+    if isinstance(val, bool):
+        return "t" if val else "f"
+    if isinstance(val, int):
+        return str(val)
+    if isinstance(val, list):
+        val = array_literal(val)
+    return '"' + str(val).replace('"', '""') + '"'
+
+
+def make_csv(objs, columns) -> str:
+    """csv data for COPY from ORM objects"""
+    buf = io.StringIO()
+    for obj in objs:
+        buf.write(",".join(csv_value(column_value(obj, col)) for col in columns))
+        buf.write("\n")
+    return buf.getvalue()
+
+
+def copy_csv(cursor, table: str, columns, data: str):
+    """COPY csv data to table by DBAPI cursor (psycopg2 or psycopg 3)"""
+    sql = "COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (table, ", ".join(columns))
+    if hasattr(cursor, "copy_expert"):  # psycopg2
+        cursor.copy_expert(sql, io.StringIO(data))
+    else:
+        with cursor.copy(sql) as copy:
+            copy.write(data)
+
+
+def create_staging(engine, suffix=""):
+    """create unlogged staging tables (columns only: no keys, indexes and WAL)"""
+    with engine.connect() as connection:
+        for obj in BULK_TABLES:
+            connection.execute(text(
+                "CREATE UNLOGGED TABLE IF NOT EXISTS %s (LIKE %s INCLUDING DEFAULTS)" % (
+                    staging_table(obj, suffix), obj.__tablename__
+                )
+            ))
+        connection.commit()
+
+
+def drop_staging(engine, suffix=""):
+    """drop staging tables"""
+    with engine.connect() as connection:
+        for obj in BULK_TABLES:
+            connection.execute(text("DROP TABLE IF EXISTS %s" % staging_table(obj, suffix)))
+        connection.commit()
+
+
+class BulkStats:
+    """rows copied to staging and really inserted to main tables, seconds of loading"""
+
+    def __init__(self):
+        self.copied = {obj.__tablename__: 0 for obj in BULK_TABLES}
+        self.inserted = {obj.__tablename__: 0 for obj in BULK_TABLES}
+        self.seconds = 0.0
+
+    def as_dict(self):
+        """counters for passing from worker process"""
+        return {"copied": self.copied, "inserted": self.inserted, "seconds": self.seconds}
+
+    def merge(self, stats):
+        """add counters of other loader (as_dict() of parallel worker)"""
+        for table, count in stats["copied"].items():
+            self.copied[table] += count
+        for table, count in stats["inserted"].items():
+            self.inserted[table] += count
+        self.seconds += stats["seconds"]
+
+    def report(self, seconds=None):
+        """log rows/sec of load, seconds -- wall time of parallel load"""
+        if seconds is None:
+            seconds = self.seconds
+        rows = sum(self.copied.values())
+        rate = rows / seconds if seconds > 0 else 0
+        for obj in BULK_TABLES:
+            table = obj.__tablename__
+            logging.info("bulk: %-14s %9s rows, %9s new", table, self.copied[table], self.inserted[table])
+        logging.info("bulk: %s rows in %.1fs, %.0f rows/s", rows, seconds, rate)
+
+
+class BulkLoader:
+    """
+    load batches of book records with COPY, merge with INSERT ... ON CONFLICT DO NOTHING,
+    rows are merged in primary key order, so parallel loaders lock them in the same order
+    """
+
+    def __init__(self, engine, suffix=""):
+        self.engine = engine
+        self.suffix = suffix
+        self.stats = BulkStats()
+        create_staging(engine, suffix)
+
+    def load(self, book_list):
+        """load book records (already filtered by hide_deleted) in one transaction"""
+        authors = {}
+        seqs = {}
+        genres = {}
+        books = {}
+        with stage("db.prepare"):
+            for book in book_list:
+                authors = fill_authors_book(authors, book)
+                seqs = fill_sequences_book(seqs, book)
+                genres = fill_genres_book(genres, book)
+                books = fill_books(books, book)
+            data = {
+                Book: make_books_db(books),
+                BookDescription: make_book_descr_db(books),
+                BookAuthorLink: make_book_authors_db(books),
+                BookSequenceLink: make_book_seqs_db(books),
+                BookGenre: make_genres_db(genres),
+                BookSequence: make_seqs_db(seqs),
+                BookAuthor: make_authors_db(authors)
+            }
+        start = time.monotonic()
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            for obj in BULK_TABLES:
+                self.load_table(cursor, obj, data[obj])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        self.stats.seconds += time.monotonic() - start
+
+    def load_table(self, cursor, obj, objs):
+        """COPY rows to staging table and merge them to main table"""
+        if len(objs) == 0:
+            return
+        table = obj.__tablename__
+        staging = staging_table(obj, self.suffix)
+        columns = obj.__table__.columns
+        names = ", ".join(table_columns(obj))
+        pkey = ", ".join('"%s"' % col.name for col in obj.__table__.primary_key.columns)
+        cursor.execute("TRUNCATE %s" % staging)
+        with stage("db.prepare"):
+            data = make_csv(objs, columns)
+        with stage("db.copy"):
+            copy_csv(cursor, staging, table_columns(obj), data)
+        with stage("db.merge"):
+            cursor.execute('INSERT INTO %s (%s) SELECT %s FROM %s ORDER BY %s ON CONFLICT DO NOTHING' % (
+                table, names, names, staging, pkey
+            ))
+        self.stats.copied[table] += len(objs)
+        self.stats.inserted[table] += max(cursor.rowcount, 0)
+
+    def close(self):
+        """drop staging tables"""
+        drop_staging(self.engine, self.suffix)
+
+
+def search_indexes(engine, tables):
+    """trigram/array (gin) and vector (hnsw) indexes of tables (ORM classes), which exist in database"""
+    ret = []
+    existing = set(inspect(engine).get_table_names())
+    names = {obj.__tablename__ for obj in tables}
+    for table in Base.metadata.sorted_tables:
+        if table.name not in names or table.name not in existing:
+            continue  # i.e. vectors without vector_search
+        for index in table.indexes:
+            if index.dialect_options["postgresql"]["using"] in DEFERRED_INDEX_TYPES:
+                ret.append(index)
+    return ret
+
+
+def drop_search_indexes(engine, tables):
+    """drop search indexes of tables before bulk load, return dropped indexes"""
+    indexes = search_indexes(engine, tables)
+    with engine.connect() as connection:
+        for index in indexes:
+            logging.info("dropping index %s", index.name)
+            connection.execute(text("DROP INDEX IF EXISTS %s" % index.name))
+        connection.commit()
+    return indexes
+
+
+def build_search_indexes(engine, indexes):
+    """build indexes with maintenance_work_mem from config and analyze their tables, return seconds"""
+    start = time.monotonic()
+    with engine.connect() as connection:
+        connection.execute(text("SET maintenance_work_mem = '%s'" % CONFIG['DB_MAINTENANCE_MEM']))
+        for index in indexes:
+            index_start = time.monotonic()
+            with stage("db.index"):
+                index.create(bind=connection, checkfirst=True)
+            connection.commit()
+            logging.info("index %s built in %.1fs", index.name, time.monotonic() - index_start)
+        with stage("db.analyze"):
+            for table in sorted({index.table.name for index in indexes}):
+                connection.execute(text("ANALYZE %s" % table))
+        connection.commit()
+    return time.monotonic() - start
+
+
+class DeferredIndexes:
+    """
+    search indexes of loaded tables, which are dropped after the first booklist (probe) is loaded with them;
+    probe and booklists loaded after it in the same (sequential) way give books/s with and without index
+    maintenance, by their ratio load time with indexes is estimated for the whole load
+    """
+
+    def __init__(self, engine, tables):
+        self.engine = engine
+        self.tables = tables
+        self.indexes = None  # dropped indexes, None -- not dropped yet
+        self.probe_books = 0
+        self.probe_seconds = 0.0
+        self.sample_books = 0
+        self.sample_seconds = 0.0
+        self.load_start = None
+
+    def probed(self) -> bool:
+        """probe is loaded, indexes are dropped"""
+        return self.indexes is not None
+
+    def loaded(self, books: int, seconds: float):
+        """
+        booklist with books is loaded sequentially in seconds: the first one is probe (with indexes, which are
+        dropped after it), the next are samples of load without indexes
+        """
+        if not self.probed():
+            self.probe_books = books
+            self.probe_seconds = seconds
+            self.indexes = drop_search_indexes(self.engine, self.tables)
+            self.load_start = time.monotonic()
+        else:
+            self.sample_books += books
+            self.sample_seconds += seconds
+
+    def finish(self):
+        """rebuild dropped indexes and log estimate of time saved"""
+        if not self.probed():
+            logging.info("deferred indexes: nothing loaded, indexes are not dropped")
+            return
+        load_seconds = time.monotonic() - self.load_start
+        rebuild_seconds = build_search_indexes(self.engine, self.indexes)
+        logging.info(
+            "deferred indexes: probe %s books in %.1fs with indexes, load %.1fs without index maintenance, "
+            "rebuild with analyze %.1fs",
+            self.probe_books, self.probe_seconds, load_seconds, rebuild_seconds
+        )
+        if self.probe_books == 0 or self.probe_seconds <= 0 or self.sample_books == 0 or self.sample_seconds <= 0:
+            logging.info("deferred indexes: not enough booklists (at least 2 needed) to estimate time saved")
+            return
+        # slowdown of load by index maintenance, measured on probe and samples
+        ratio = (self.sample_books / self.sample_seconds) / (self.probe_books / self.probe_seconds)
+        estimated = load_seconds * ratio
+        saved = estimated - (load_seconds + rebuild_seconds)
+        logging.info(
+            "deferred indexes: load with indexes estimated %.1fs (%.2fx slower), with deferred indexes %.1fs, "
+            "time saved %.1fs",
+            estimated, ratio, load_seconds + rebuild_seconds, saved
+        )
+
+
+@contextmanager
+def deferred_indexes(tables, enabled=True):
+    """
+    DeferredIndexes for loaded tables (FILL_TABLES, VECTORS_TABLES) or None if not enabled;
+    loader must call loaded() after every booklist loaded in main process, dropped indexes are rebuilt
+    after load (even if load failed)
+    """
+    if not enabled:
+        yield None
+        return
+    deferred = DeferredIndexes(dbconnect(), tables)
+    try:
+        yield deferred
+    finally:
+        deferred.finish()
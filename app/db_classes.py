@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """database definitions"""
 
+import os
 import enum
 
 # from sqlalchemy import *
@@ -18,13 +19,18 @@ from sqlalchemy import (
 from pgvector.sqlalchemy import Vector, HALFVEC
 from sqlalchemy.dialects.postgresql import ARRAY, TEXT
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.sql import func
 
 from .config import CONFIG, VECTOR_SIZE
 
 Base = declarative_base()
 
+# one engine (connection pool) per process, created on first use, see dbconnect()
+ENGINE = {"engine": None}
+# sessions of current thread: web request (removed in app teardown) or indexer
+SESSIONS = scoped_session(sessionmaker())
+
 # pylint: disable=R0903
 
 
@@ -49,6 +55,31 @@ class Book(Base):
     date = Column(Date)
     size = Column(Integer)
     deleted = Column(Boolean)
+    __table_args__ = (
+        # for genres.contains([gen_id]) i.e. `genres @> ARRAY[...]`
+        Index('books_genres', 'genres', postgresql_using="gin"),
+    )
+
+
+class BookAuthorLink(Base):
+    """book to author link (indexed form of Book.authors)"""
+    __tablename__ = 'book_authors'
+    book_id = Column(String(32), ForeignKey("books.book_id"), primary_key=True)
+    author_id = Column(String(32), primary_key=True)
+    __table_args__ = (
+        Index('book_authors_author', 'author_id'),
+    )
+
+
+class BookSequenceLink(Base):
+    """book to sequence link with number of book in sequence (indexed form of Book.sequences)"""
+    __tablename__ = 'book_sequences'
+    book_id = Column(String(32), ForeignKey("books.book_id"), primary_key=True)
+    seq_id = Column(String(32), primary_key=True)
+    num = Column(Integer)
+    __table_args__ = (
+        Index('book_sequences_seq', 'seq_id', 'num'),
+    )
 
 
 class BookDescription(Base):
@@ -142,7 +173,9 @@ class VectorsData(Base):
 
 
 def dbconnect():
-    """connect to db and return engine"""
+    """return engine of this process, engine and its connection pool are created on first call"""
+    if ENGINE["engine"] is not None:
+        return ENGINE["engine"]
     # dbpath = "postgresql+psycopg2://%s:%s@%s:5432/%s" % (
     # dbpath = "postgresql://%s:%s@%s:5432/%s" % (
     dbpath = "postgresql://%s@%s:5432/%s" % (
@@ -152,13 +185,38 @@ def dbconnect():
         CONFIG['PG_BASE']
     )
     # engine = create_engine(dbpath)
-    engine = create_engine(dbpath, connect_args={'password': CONFIG['PG_PASS']})
+    engine = create_engine(
+        dbpath,
+        connect_args={'password': CONFIG['PG_PASS']},
+        pool_size=int(CONFIG['DB_POOL_SIZE']),
+        max_overflow=int(CONFIG['DB_POOL_OVERFLOW']),
+        pool_recycle=int(CONFIG['DB_POOL_RECYCLE']),
+        pool_pre_ping=True  # drop connections closed by server restart or timeouts
+    )
+    SESSIONS.configure(bind=engine)
+    ENGINE["engine"] = engine
     return engine
 
 
 def dbsession():
-    """connect to db and return session"""
-    engine = dbconnect()
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    return session
+    """return session of current thread on process engine"""
+    dbconnect()
+    return SESSIONS()
+
+
+def dbsession_remove(exc=None):  # pylint: disable=W0613
+    """close and forget session of current thread (flask teardown)"""
+    SESSIONS.remove()
+
+
+def dbreset_after_fork():
+    """
+    forked child (gunicorn worker, indexer pool process) must not use connections of parent:
+    drop them from pool without closing, new connections will be made on demand
+    """
+    SESSIONS.registry.clear()
+    if ENGINE["engine"] is not None:
+        ENGINE["engine"].dispose(close=False)
+
+
+os.register_at_fork(after_in_child=dbreset_after_fork)
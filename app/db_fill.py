@@ -2,36 +2,75 @@
 """database update"""
 
 import logging
-import glob
-import json
+import os
+import time
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import sessionmaker
 
 from .config import CONFIG
-from .db_classes import dbconnect, dbsession, GenresMeta, BookDescription, VectorType, VectorsData
+from .booklist import booklists, open_booklist, book_from_line
+from .trace import stage, add_books, add_zip_time, take_trace, merge_trace, reset_trace
+from .db_bulk import BulkLoader, BulkStats, row_dicts
+from .db_classes import (
+    dbconnect,
+    dbsession,
+    GenresMeta,
+    BookAuthor,
+    BookSequence,
+    BookGenre,
+    Book,
+    BookDescription,
+    VectorType,
+    VectorsData
+)
 from .data import (
     genres_to_meta_init,
     fill_authors_book,
     fill_sequences_book,
     fill_genres_book,
     fill_books,
+    drop_existing,
     make_authors_db,
     make_seqs_db,
     make_genres_db,
     make_books_db,
     make_book_descr_db,
-    open_booklist,
+    make_book_authors_db,
+    make_book_seqs_db,
     make_anno_vectors,
     get_count
 )
 
+INSERT_CHUNK = 1000  # rows in one INSERT ... ON CONFLICT DO NOTHING
+
 
-def dbwrite(data):
-    """write prepared data to db"""
+def dbwrite(data, session=None):
+    """write prepared data to db (in given session or in new one, which is closed after)"""
+    if session is not None:
+        session.add_all(data)
+        session.commit()
+        return
     engine = dbconnect()
     Session = sessionmaker(bind=engine)
-    session = Session()
-    session.add_all(data)
+    with Session() as session:
+        session.add_all(data)
+        session.commit()
+
+
+def dbinsert_new(session, data):
+    """
+    insert prepared data skipping rows, which are already in db (i.e. just added by parallel worker),
+    rows are inserted in primary key order and committed per table, so workers can't deadlock
+    """
+    if len(data) == 0:
+        return
+    table = data[0].__table__
+    pkey = [col.name for col in table.primary_key.columns]
+    rows = sorted(row_dicts(data), key=lambda row: [row[col] for col in pkey])
+    for pos in range(0, len(rows), INSERT_CHUNK):
+        session.execute(pg_insert(table).values(rows[pos:pos + INSERT_CHUNK]).on_conflict_do_nothing())
     session.commit()
 
 
@@ -55,23 +94,96 @@ def fill_genres_meta():  # pylint: disable=C0103
     session.commit()
 
 
-def process_booklists_db(stage='fillonly'):
-    """get booklists and fill it to process_booklist"""
+def process_booklists_db(stage='fillonly', bulk=False, jobs=1, deferred=None):
+    """
+    get booklists and fill it to process_booklist, bulk -- load by COPY (see app/db_bulk.py),
+    jobs -- fill booklists in N processes, every one with own connection,
+    deferred -- DeferredIndexes (see app/db_bulk.py), with jobs its probe and sample booklists are
+    filled in this process before others
+    """
     logging.info("begin stage %s", stage)
     zipdir = CONFIG['ZIPS']
+    start = time.monotonic()
 
     genres_to_meta_init()  # fill internal var by predefined data
 
+    lists = booklists(zipdir)
+    sequential = lists
+    if jobs > 1:
+        sequential = lists[:2] if deferred is not None else []
+
+    session = dbsession()  # one connection for all batches
+    loader = BulkLoader(dbconnect()) if bulk and len(sequential) > 0 else None
     i = 0
-    for booklist in sorted(glob.glob(zipdir + '/*.zip.list') + glob.glob(zipdir + '/*.zip.list.gz')):
+    for booklist in sequential:
         logging.info("[%s] %s", str(i), booklist)
-        process_booklist(booklist, CONFIG['HIDE_DELETED'])
+        list_start = time.monotonic()
+        count = process_booklist(booklist, CONFIG['HIDE_DELETED'], session, loader)
+        if deferred is not None:
+            deferred.loaded(count, time.monotonic() - list_start)
         i = i + 1
-    logging.info("end stage %s", stage)
+    session.close()
+    if loader is not None:
+        loader.close()
+        if jobs <= 1:
+            loader.stats.report()
+    if jobs > 1:
+        process_booklists_parallel(
+            lists[len(sequential):], bulk, jobs, loader.stats if loader is not None else None, start
+        )
+    logging.info("end stage %s in %.1fs", stage, time.monotonic() - start)
+
+
+def process_booklist_task(booklist, hide_deleted, bulk):
+    """
+    process_booklist() in worker process on its own connection (engine is reset after fork),
+    return (bulk loader counters or None, trace data)
+    """
+    session = dbsession()
+    loader = BulkLoader(dbconnect(), "_%s" % os.getpid()) if bulk else None
+    try:
+        process_booklist(booklist, hide_deleted, session, loader)
+    finally:
+        session.close()
+        if loader is not None:
+            loader.close()
+    return (loader.stats.as_dict() if loader is not None else None), take_trace()
+
+
+def process_booklists_parallel(lists, bulk, jobs, stats=None, start=None):
+    """
+    fill booklists in `jobs` processes,
+    stats and start -- bulk counters and start time of booklists already filled in this process
+    """
+    if start is None:
+        start = time.monotonic()
+    total = len(lists)
+    failed = 0
+    if stats is None:
+        stats = BulkStats()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=reset_trace) as executor:
+        futures = {}
+        for booklist in lists:
+            futures[executor.submit(process_booklist_task, booklist, CONFIG['HIDE_DELETED'], bulk)] = booklist
+        for num, future in enumerate(as_completed(futures), start=1):
+            try:
+                loader_stats, trace_data = future.result()
+                merge_trace(trace_data)
+                if loader_stats is not None:
+                    stats.merge(loader_stats)
+                logging.info("[%s/%s] %s", num, total, futures[future])
+            except Exception as ex:  # pylint: disable=W0703
+                failed += 1
+                logging.error("[%s/%s] %s: FAILED: %s", num, total, futures[future], ex)
+    if bulk:
+        stats.report(time.monotonic() - start)
+    if failed > 0:
+        logging.error("failed booklists: %s", failed)
 
 
-def process_booklist(booklist, hide_deleted="no"):
-    """get data from booklist and fill it to db"""
+def process_booklist(booklist, hide_deleted, session, loader=None):
+    """get data from booklist and fill it to db, return count of records"""
+    start = time.monotonic()
     with open_booklist(booklist) as lst:
         count = 0
         lines = lst.readlines(int(CONFIG["PASS_SIZE_HINT"]))
@@ -79,33 +191,65 @@ def process_booklist(booklist, hide_deleted="no"):
             count = count + len(lines)
             # print("   %s" % count)
             logging.debug("   %s", count)
-            process_books_batch(lines, hide_deleted)
+            if loader is not None:
+                process_books_bulk(loader, lines, hide_deleted)
+            else:
+                process_books_batch(session, lines, hide_deleted)
             lines = lst.readlines(int(CONFIG["PASS_SIZE_HINT"]))
+    add_books(booklist, count, os.path.getsize(booklist))
+    add_zip_time(booklist, time.monotonic() - start)
+    return count
+
+
+def process_books_bulk(loader, lines, hide_deleted):
+    """fill books data to db by bulk loader, existing rows are skipped by database"""
+    book_list = []
+    with stage("db.prepare"):
+        for line in lines:
+            book = book_from_line(line)
+            if book is None:
+                continue
+            if hide_deleted == "yes" and "deleted" in book and book["deleted"] == 1:
+                continue
+            book_list.append(book)
+    loader.load(book_list)
 
 
-def process_books_batch(lines, hide_deleted):
-    """fill books data to db"""
+def process_books_batch(session, lines, hide_deleted):
+    """fill books data to db, existence of authors/sequences/genres/books is checked once per batch"""
     authors = {}
     seqs = {}
     genres = {}
     books = {}
     deleted_cnt = 0
-    for line in lines:
-        book = json.loads(line)
-        if book is None:
-            continue
-        if hide_deleted == "yes" and "deleted" in book and book["deleted"] == 1:
-            deleted_cnt = deleted_cnt + 1
-            continue
-        authors = fill_authors_book(authors, book)
-        seqs = fill_sequences_book(seqs, book)
-        genres = fill_genres_book(genres, book)
-        books = fill_books(books, book)
-    dbwrite(make_books_db(books))
-    dbwrite(make_book_descr_db(books))
-    dbwrite(make_genres_db(genres))
-    dbwrite(make_seqs_db(seqs))
-    dbwrite(make_authors_db(authors))
+    with stage("db.prepare"):
+        for line in lines:
+            book = book_from_line(line)
+            if book is None:
+                continue
+            if hide_deleted == "yes" and "deleted" in book and book["deleted"] == 1:
+                deleted_cnt = deleted_cnt + 1
+                continue
+            authors = fill_authors_book(authors, book)
+            seqs = fill_sequences_book(seqs, book)
+            genres = fill_genres_book(genres, book)
+            books = fill_books(books, book)
+        # links of all books, as in bulk load: books filled before link tables get them too
+        book_authors = make_book_authors_db(books)
+        book_seqs = make_book_seqs_db(books)
+    with stage("db.query"):
+        authors = drop_existing(session, BookAuthor.id, authors)
+        seqs = drop_existing(session, BookSequence.id, seqs)
+        genres = drop_existing(session, BookGenre.id, genres)
+        books = drop_existing(session, Book.book_id, books)
+    with stage("db.insert"):
+        dbinsert_new(session, make_books_db(books))
+        dbinsert_new(session, make_book_descr_db(books))
+        dbinsert_new(session, book_authors)
+        dbinsert_new(session, book_seqs)
+        dbinsert_new(session, make_genres_db(genres))
+        dbinsert_new(session, make_seqs_db(seqs))
+        dbinsert_new(session, make_authors_db(authors))
     if hide_deleted == "yes":
         logging.debug(f"      deleted {deleted_cnt}")
 
@@ -134,7 +278,7 @@ def process_books_vectors(session, lines, hide_deleted):
     book_ids = []
     book_data = {}
     for line in lines:
-        book = json.loads(line)
+        book = book_from_line(line)
         if book is None:
             continue
         if hide_deleted == "yes" and "deleted" in book and book["deleted"] == 1:
@@ -154,8 +298,8 @@ def process_books_vectors(session, lines, hide_deleted):
     logging.debug("  - processed: %s, in pass: %s", len(ids), len(book_ids))
 
 
-def make_vectors():
-    """make vectors for books vector search"""
+def make_vectors(deferred=None):
+    """make vectors for books vector search, deferred -- DeferredIndexes (see app/db_bulk.py)"""
 
     # for genre names
     genres_to_meta_init()
@@ -167,13 +311,17 @@ def make_vectors():
     session = dbsession()
     logging.info("Making annotations vectors...")
     i = 0
-    for booklist in sorted(glob.glob(zipdir + '/*.zip.list') + glob.glob(zipdir + '/*.zip.list.gz')):
+    for booklist in booklists(zipdir):
         logging.info("[%s] %s", str(i), booklist)
         i = i + 1
+        list_start = time.monotonic()
         with open_booklist(booklist) as lst:
             count = 0
             lines = lst.readlines(int(CONFIG["PASS_SIZE_HINT"]))
             while len(lines) > 0:
+                count = count + len(lines)
                 process_books_vectors(session, lines, hide_deleted)
                 lines = lst.readlines(int(CONFIG["PASS_SIZE_HINT"]))
+        if deferred is not None:
+            deferred.loaded(count, time.monotonic() - list_start)
     logging.info("end")
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""sync database with booklists: upsert changed rows, delete vanished books and orphaned authors/sequences"""
+
+import logging
+import os
+import time
+
+from sqlalchemy import select, delete, distinct, exists, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .config import CONFIG
+from .booklist import booklists, booklist_base, open_booklist, book_from_line
+from .trace import stage, add_books, add_zip_time
+from .db_classes import (
+    dbsession,
+    Book,
+    BookDescription,
+    BookAuthorLink,
+    BookSequenceLink,
+    BookAuthor,
+    BookSequence,
+    BookGenre,
+    VectorsData
+)
+from .db_bulk import row_dicts
+from .data import (
+    genres_to_meta_init,
+    fill_authors_book,
+    fill_sequences_book,
+    fill_genres_book,
+    fill_books,
+    make_authors_db,
+    make_seqs_db,
+    make_genres_db,
+    make_books_db,
+    make_book_descr_db,
+    make_book_authors_db,
+    make_book_seqs_db
+)
+
+SYNC_CHUNK = 1000  # rows in one INSERT ... ON CONFLICT or ids in one DELETE
+
+
+def vectors_enabled() -> bool:
+    """vectors table exists"""
+    return CONFIG["VECTOR_SEARCH"] in (True, 'yes', 'YES', 'Yes')
+
+
+def upsert(session, obj, rows, update_cols, where=None):
+    """
+    insert rows, update existing rows with changed update_cols (only if where is true for them),
+    return list of primary keys of inserted or really changed rows
+    """
+    ret = []
+    table = obj.__table__
+    pkey = table.primary_key.columns.values()[0]
+    for pos in range(0, len(rows), SYNC_CHUNK):
+        stmt = pg_insert(table).values(rows[pos:pos + SYNC_CHUNK])
+        if len(update_cols) == 0:
+            stmt = stmt.on_conflict_do_nothing()
+        else:
+            changed = None
+            for col in update_cols:
+                cond = table.c[col].is_distinct_from(stmt.excluded[col])
+                changed = cond if changed is None else changed | cond
+            if where is not None:
+                changed = changed & where(table, stmt.excluded)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[pkey],
+                set_={col: stmt.excluded[col] for col in update_cols},
+                where=changed
+            )
+        ret.extend(session.execute(stmt.returning(pkey)).scalars().all())
+    return ret
+
+
+def delete_ids(session, column, ids):
+    """delete rows by ids in chunks, return count"""
+    ids = list(ids)
+    count = 0
+    for pos in range(0, len(ids), SYNC_CHUNK):
+        count += session.execute(delete(column.table).where(column.in_(ids[pos:pos + SYNC_CHUNK]))).rowcount
+    return count
+
+
+def delete_books(session, book_ids):
+    """delete books with descriptions, links and vectors"""
+    if vectors_enabled():
+        delete_ids(session, VectorsData.id, book_ids)
+    delete_ids(session, BookDescription.book_id, book_ids)
+    delete_links(session, book_ids)
+    return delete_ids(session, Book.book_id, book_ids)
+
+
+def delete_links(session, book_ids):
+    """delete book_authors/book_sequences rows of books"""
+    delete_ids(session, BookAuthorLink.book_id, book_ids)
+    delete_ids(session, BookSequenceLink.book_id, book_ids)
+
+
+def stored_links(session, obj, book_ids):
+    """set of stored rows (as tuples of column values) of link table for books"""
+    ret = set()
+    table = obj.__table__
+    book_ids = list(book_ids)
+    for pos in range(0, len(book_ids), SYNC_CHUNK):
+        ret.update(tuple(row) for row in session.execute(
+            select(*table.columns).where(table.c.book_id.in_(book_ids[pos:pos + SYNC_CHUNK]))
+        ))
+    return ret
+
+
+def sync_links(session, books):
+    """
+    make links of books (dict book_id: book record) the same as in records: only differing rows are
+    deleted/inserted (books without links yet, i.e. filled before link tables, get all of them)
+    """
+    for obj, objs in (
+        (BookAuthorLink, make_book_authors_db(books)),
+        (BookSequenceLink, make_book_seqs_db(books))
+    ):
+        table = obj.__table__
+        columns = table.columns.keys()
+        new = {tuple(row[col] for col in columns) for row in row_dicts(objs)}
+        old = stored_links(session, obj, books.keys())
+        pkey = [columns.index(col.name) for col in table.primary_key.columns]
+        gone = [tuple(row[idx] for idx in pkey) for row in old - new]
+        for pos in range(0, len(gone), SYNC_CHUNK):
+            session.execute(delete(table).where(
+                tuple_(*table.primary_key.columns).in_(gone[pos:pos + SYNC_CHUNK])
+            ))
+        upsert(session, obj, [dict(zip(columns, row)) for row in sorted(new - old)], [])
+
+
+def own_books(session, zip_name, book_ids):
+    """book ids, which are stored in database as books of zip_name"""
+    ret = set()
+    book_ids = list(book_ids)
+    for pos in range(0, len(book_ids), SYNC_CHUNK):
+        ret.update(session.execute(select(Book.book_id).where(
+            Book.zipfile == zip_name,
+            Book.book_id.in_(book_ids[pos:pos + SYNC_CHUNK])
+        )).scalars().all())
+    return ret
+
+
+def sync_books_batch(session, zip_name, book_list, stats):
+    """upsert batch of book records from zip_name, return ids of books"""
+    authors = {}
+    seqs = {}
+    genres = {}
+    books = {}
+    with stage("db.prepare"):
+        for book in book_list:
+            authors = fill_authors_book(authors, book)
+            seqs = fill_sequences_book(seqs, book)
+            genres = fill_genres_book(genres, book)
+            books = fill_books(books, book)
+    with stage("db.upsert"):
+        # book with the same id in other .zip is left to first one, as in fillonly
+        changed = upsert(
+            session, Book, row_dicts(make_books_db(books)),
+            [col for col in Book.__table__.columns.keys() if col != "book_id"],
+            where=lambda table, excluded: table.c.zipfile == excluded.zipfile
+        )
+        own = {key: books[key] for key in own_books(session, zip_name, books.keys())}
+        descr_changed = upsert(
+            session, BookDescription, row_dicts(make_book_descr_db(own)),
+            [col for col in BookDescription.__table__.columns.keys() if col != "book_id"]
+        )
+        sync_links(session, own)
+        if vectors_enabled() and len(descr_changed) > 0:
+            delete_ids(session, VectorsData.id, descr_changed)  # made again by `vectors`
+        upsert(session, BookGenre, row_dicts(make_genres_db(genres)), [])
+        stats["sequences"] += len(upsert(session, BookSequence, row_dicts(make_seqs_db(seqs)), ["name"]))
+        stats["authors"] += len(upsert(session, BookAuthor, row_dicts(make_authors_db(authors)), ["name"]))
+        session.commit()
+    stats["books"] += len(set(changed) | set(descr_changed))
+    return books.keys()
+
+
+def sync_booklist(session, booklist, hide_deleted, stats):
+    """sync books of one .zip with its booklist"""
+    start = time.monotonic()
+    zip_name = os.path.basename(booklist_base(booklist))
+    seen = set()
+    count = 0
+    with open_booklist(booklist) as lst:
+        lines = lst.readlines(int(CONFIG["PASS_SIZE_HINT"]))
+        while len(lines) > 0:
+            count = count + len(lines)
+            logging.debug("   %s", count)
+            book_list = []
+            for line in lines:
+                book = book_from_line(line)
+                if book is None:
+                    continue
+                if hide_deleted == "yes" and "deleted" in book and book["deleted"] == 1:
+                    continue
+                book_list.append(book)
+            seen.update(sync_books_batch(session, zip_name, book_list, stats))
+            lines = lst.readlines(int(CONFIG["PASS_SIZE_HINT"]))
+    with stage("db.prune"):
+        in_db = session.execute(select(Book.book_id).where(Book.zipfile == zip_name)).scalars().all()
+        stats["deleted"] += delete_books(session, set(in_db) - seen)
+        session.commit()
+    add_books(booklist, count, os.path.getsize(booklist))
+    add_zip_time(booklist, time.monotonic() - start)
+    return zip_name
+
+
+def delete_orphans(session, obj, link_column):
+    """
+    delete authors/sequences, which are not referred by any book (and their vectors),
+    NOT EXISTS by indexed link table is planned as anti join (NOT IN over unnested arrays is not hashed,
+    if they don't fit to work_mem, and rescanned for every row)
+    """
+    orphans = session.execute(
+        select(obj.id).where(~exists().where(link_column == obj.id))
+    ).scalars().all()
+    if vectors_enabled():
+        delete_ids(session, VectorsData.id, orphans)
+    return delete_ids(session, obj.id, orphans)
+
+
+def process_booklists_sync():
+    """update database by booklists: changed books/authors/sequences are updated, vanished are deleted"""
+    logging.info("begin stage fillall")
+    genres_to_meta_init()
+    session = dbsession()
+    stats = {"books": 0, "deleted": 0, "authors": 0, "sequences": 0}
+    zips = set()
+    for num, booklist in enumerate(booklists(CONFIG['ZIPS'])):
+        logging.info("[%s] %s", num, booklist)
+        zips.add(sync_booklist(session, booklist, CONFIG['HIDE_DELETED'], stats))
+    if len(zips) == 0:
+        # unmounted or misconfigured zips path must not wipe database
+        logging.error("NO BOOKLISTS FOUND IN %s, REFUSING TO DELETE ANYTHING FROM DATABASE", CONFIG['ZIPS'])
+        session.close()
+        logging.info("end stage fillall")
+        return
+    with stage("db.prune"):
+        for zip_name in session.execute(select(distinct(Book.zipfile))).scalars().all():
+            if zip_name not in zips:
+                logging.info("%s is gone, deleting its books", zip_name)
+                in_db = session.execute(select(Book.book_id).where(Book.zipfile == zip_name)).scalars().all()
+                stats["deleted"] += delete_books(session, in_db)
+        orphan_authors = delete_orphans(session, BookAuthor, BookAuthorLink.author_id)
+        orphan_seqs = delete_orphans(session, BookSequence, BookSequenceLink.seq_id)
+        session.commit()
+    session.close()
+    logging.info(
+        "books new or changed: %s, deleted: %s; authors new or renamed: %s, deleted: %s; "
+        "sequences new or renamed: %s, deleted: %s",
+        stats["books"], stats["deleted"], stats["authors"], orphan_authors, stats["sequences"], orphan_seqs
+    )
+    logging.info("end stage fillall")
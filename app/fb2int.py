@@ -7,7 +7,9 @@ import sys
 import io
 import logging
 import base64
+import hashlib
 import collections
+import threading
 # import traceback  # DEBUG
 
 from datetime import datetime
@@ -19,8 +21,20 @@ import xmltodict
 from .config import CONFIG
 from .strings import strlist, num2int, make_id
 from .data import decode_b64
+from .fb2stream import get_fb2header
+from .trace import stage
 
 FB2_HEADER_LIMIT = 20000  # nearly 20kB for metadata text
+THUMB_REDUCING_GAP = 3.0  # see PIL.Image.resize(), reduce by integer factor before LANCZOS
+THUMBS_CACHE_SIZE = 256  # previews, cached by source image hash
+
+THUMBS_CACHE = collections.OrderedDict()  # LRU: recently used previews are at the end
+THUMBS_CACHE_LOCK = threading.Lock()  # previews are made in threads (see iter_previews())
+# for namespaced fb2: default namespace and 'l:' prefix for xlink attributes (i.e. '@l:href' of cover image)
+FB2_NAMESPACES = {
+    'http://www.gribuser.ru/xml/fictionbook/2.0': None,
+    'http://www.w3.org/1999/xlink': 'l'
+}
 
 
 def get_struct_by_key(key: str, struct):
@@ -264,10 +278,11 @@ def get_pub_info(pubinfo):
     return isbn, year, publisher
 
 
-def get_image(name: str, binary, last=True, context=None):  # pylint: disable=R0912,R0914
+def get_image(name: str, binary, last=True, context=None, preview=True):  # pylint: disable=R0912,R0914
     """
     return {"content-type": "image/jpeg", "data": "<image data in jpeg>"}
     content-type must be correspond for image data format
+    if preview is False, return source image data without resizing
     """
     logging.getLogger("PIL.PngImagePlugin").setLevel(logging.CRITICAL)
     ret = None
@@ -294,31 +309,67 @@ def get_image(name: str, binary, last=True, context=None):  # pylint: disable=R0
                 if tmp is not None:
                     ret = tmp
                     break
-    if ret is not None and last is True:
-        try:
-            # basewidth = 300
-            basewidth = int(CONFIG['PIC_WIDTH'])
-            # buf = io.BytesIO(base64.b64decode(ret["data"] + '=='))  # additinally pad db64
-            buf = io.BytesIO(decode_b64(ret["data"]))
-            img = Image.open(buf).convert('RGB')
-            wpercent = basewidth/float(img.size[0])
-            if wpercent < 1:
-                hsize = int((float(img.size[1])*float(wpercent)))
-                img = img.resize((basewidth, hsize), Image.LANCZOS)
-            buffout = io.BytesIO()
-            img.save(buffout, format="JPEG", quality="web_medium")
-            data = base64.b64encode(buffout.getvalue())
-            ret["content-type"] = "image/jpeg"
-            ret["data"] = data.decode("utf-8")
-        except Exception as ex:  # pylint: disable=W0703
-            if context is not None:
-                logging.error("Image error in: %s", context)
-            logging.error(ex)
-            # logging.debug(traceback.format_exc())
-            ret = None
+    if ret is not None and last is True and preview is True:
+        ret = make_cover_preview(ret, context)
     return ret
 
 
+def make_thumbnail(data: bytes, basewidth: int) -> bytes:
+    """
+    return jpeg image not wider than basewidth from image data
+    jpeg is decoded by draft mode at reduced scale, other formats are reduced before resampling
+    """
+    img = Image.open(io.BytesIO(data))
+    width, height = img.size
+    wpercent = basewidth/float(width)
+    hsize = height
+    if wpercent < 1:
+        hsize = int((float(height)*float(wpercent)))
+        if img.format == "JPEG":
+            # DCT scaling in decoder, result is not smaller than requested size
+            img.draft("RGB", (basewidth, max(hsize, 1)))
+    img = img.convert('RGB')
+    if wpercent < 1:
+        img = img.resize((basewidth, hsize), Image.LANCZOS, reducing_gap=THUMB_REDUCING_GAP)
+    buffout = io.BytesIO()
+    img.save(buffout, format="JPEG", quality="web_medium")
+    return buffout.getvalue()
+
+
+def make_cover_preview(cover, context=None):
+    """
+    return cover struct with image from cover struct resized to PIC_WIDTH jpeg or None on error
+    previews for the same source image are taken from cache
+    """
+    try:
+        basewidth = int(CONFIG['PIC_WIDTH'])
+        img_bytes = decode_b64(cover["data"])
+        key = hashlib.md5(img_bytes).hexdigest() + "/" + str(basewidth)
+        with THUMBS_CACHE_LOCK:
+            data = THUMBS_CACHE.get(key)
+            if data is not None:
+                THUMBS_CACHE.move_to_end(key)
+        if data is None:
+            with stage("cover.preview"):  # not under lock, previews are made in parallel
+                data = base64.b64encode(make_thumbnail(img_bytes, basewidth)).decode("utf-8")
+            with THUMBS_CACHE_LOCK:
+                if key in THUMBS_CACHE:  # made by other thread meanwhile
+                    THUMBS_CACHE.move_to_end(key)
+                elif len(THUMBS_CACHE) >= THUMBS_CACHE_SIZE:
+                    THUMBS_CACHE.popitem(last=False)  # drop least recently used
+                THUMBS_CACHE[key] = data
+        return {
+            "content-type": "image/jpeg",
+            "data": data
+        }
+    except Exception as ex:  # pylint: disable=W0703
+        if context is not None:
+            logging.error("Image error in: %s", context)
+        logging.error(ex)
+        # logging.debug(traceback.format_exc())
+    return None
+
+
 def get_fb2data(fb2_fd, zip_file, filename):
     """return FictionBook section from opened file fb2_fd"""
     sys.setrecursionlimit(10000)  # for some strange fb2 with nested <p>
@@ -329,7 +380,7 @@ def get_fb2data(fb2_fd, zip_file, filename):
         xmldata = xmltodict.parse(
             doc,
             process_namespaces=True,
-            namespaces={'http://www.gribuser.ru/xml/fictionbook/2.0': None}
+            namespaces=FB2_NAMESPACES
         )
     if 'FictionBook' not in xmldata:  # not fb2
         logging.error("not fb2: %s/%s ", zip_file, filename)
@@ -338,15 +389,13 @@ def get_fb2data(fb2_fd, zip_file, filename):
     return fb2data
 
 
-def get_book_cover(info, z_file, zip_file, filename):
-    cover = None
+def get_cover_name(info, zip_file, filename):
+    """return id of cover image <binary> from title-info struct or None"""
+    covername = None
     if "coverpage" in info and info["coverpage"] is not None:
         coverpage = info["coverpage"]
         if "image" in coverpage and coverpage["image"] is not None:
-            fb2_full = z_file.open(filename)
-            fb2data_full = get_fb2data(fb2_full, zip_file, filename)
             covermeta = coverpage["image"]
-            covername = None
             if "@l:href" in covermeta:
                 covername = covermeta["@l:href"].lstrip('#')
             elif "@xlink:href" in covermeta:
@@ -358,14 +407,31 @@ def get_book_cover(info, z_file, zip_file, filename):
                     filename,
                     coverpage
                 )
-            if "binary" in fb2data_full:
-                binary = fb2data_full["binary"]  # mostly images here
-                cover = get_image(
-                    covername,
-                    binary,
-                    context="%s/%s" % (zip_file, filename)
-                )  # get corresponding image
-    return cover
+    return covername
+
+
+def get_book_cover(info, z_file, zip_file, filename, stream=None, preview=True):
+    """
+    return cover struct for book or None
+    if stream (opened Fb2Stream after header reading) is given, only referenced <binary> is searched in it,
+    else whole fb2 will be parsed
+    if preview is False, source image is returned (see make_cover_preview())
+    """
+    covername = get_cover_name(info, zip_file, filename)
+    if covername is None:
+        return None
+    context = "%s/%s" % (zip_file, filename)
+    if stream is not None:
+        binary = stream.binary(covername)
+    else:
+        with z_file.open(filename) as fb2_full:
+            fb2data_full = get_fb2data(fb2_full, zip_file, filename)
+        binary = None
+        if "binary" in fb2data_full:
+            binary = fb2data_full["binary"]  # mostly images here
+    if binary is None:
+        return None
+    return get_image(covername, binary, context=context, preview=preview)  # get corresponding image
 
 
 def get_pubinfo(descr, zip_file, filename):
@@ -382,7 +448,7 @@ def get_pubinfo(descr, zip_file, filename):
     return pubinfo
 
 
-def make_book_record(zip_file, filename, book_id, date_time, size, info, bs_anno, cover, pub_info, inpx_data, replace_data):
+def make_book_record(zip_file, filename, book_id, date_time, size, info, bs_anno, cover, pub_info, inpx_data, replace_data):  # noqa: E501 pylint: disable=R0913
     if isinstance(info, list):
         # see f.fb2-513034-516388.zip/513892.fb2
         info = info[0]
@@ -436,19 +502,11 @@ def make_book_record(zip_file, filename, book_id, date_time, size, info, bs_anno
     }
     return out
 
-def fb2parse(z_file, filename, replace_data, inpx_data):  # pylint: disable=R0912,R0914,R0915
-    """get filename in opened zip (assume filename format as fb2), return book struct"""
-
-    file_info = z_file.getinfo(filename)
-    zip_file = str(os.path.basename(z_file.filename))
-    fb2dt = datetime(*file_info.date_time)
-    date_time = fb2dt.strftime("%F_%H:%M")
-    size = file_info.file_size
-
-    if size < 500:  # too small for real book
-        return None, None
-
-    fb2 = z_file.open(filename)
+def get_fb2header_bs(fb2, zip_file, filename):
+    """
+    legacy BeautifulSoup + xmltodict header parser
+    return (description struct, annotation xml string) or None if not fb2
+    """
     b_soap = BeautifulSoup(bytes(fb2.read(FB2_HEADER_LIMIT)), 'xml')
     # some data, taken from xml directly, so get_fb2data() can't be used
     bs_descr = b_soap.FictionBook.description
@@ -463,25 +521,69 @@ def fb2parse(z_file, filename, replace_data, inpx_data):  # pylint: disable=R091
         data = xmltodict.parse(
             doc,
             process_namespaces=True,
-            namespaces={'http://www.gribuser.ru/xml/fictionbook/2.0': None}
+            namespaces=FB2_NAMESPACES
         )
     if 'FictionBook' not in data:  # not fb2
         logging.error("not fb2: %s/%s ", zip_file, filename)
-        return None, None
+        return None
     fb2data = get_struct_by_key('FictionBook', data)  # data['FictionBook']
     descr = get_struct_by_key('description', fb2data)  # fb2data['description']
-    info = get_struct_by_key('title-info', descr)  # descr['title-info']
+    return descr, bs_anno
 
-    cover = get_book_cover(info, z_file, zip_file, filename)
 
-    isbn, pub_year, publisher = get_pub_info(get_pubinfo(descr, zip_file, filename))
-    pub_info = {
-        "isbn": isbn,
-        "year": pub_year,
-        "publisher": publisher,
-        "publisher_id": make_id(publisher)
-    }
-    book_path = str(os.path.basename(z_file.filename)) + "/" + filename
-    book_id = make_id(book_path, name_as_is=True)
-    out = make_book_record(zip_file, filename, book_id, date_time, size, info, bs_anno, cover, pub_info, inpx_data, replace_data)
+def fb2parse(z_file, filename, replace_data, inpx_data, legacy=False, preview=True):  # noqa: E501 pylint: disable=R0912,R0913,R0914,R0915
+    """
+    get filename in opened zip (assume filename format as fb2), return book struct
+    metadata is parsed by streaming parser, BeautifulSoup parser is used as fallback
+    or when legacy is True
+    if preview is False, cover is not resized and must be processed by make_cover_preview() later
+    """
+
+    file_info = z_file.getinfo(filename)
+    zip_file = str(os.path.basename(z_file.filename))
+    fb2dt = datetime(*file_info.date_time)
+    date_time = fb2dt.strftime("%F_%H:%M")
+    size = file_info.file_size
+
+    if size < 500:  # too small for real book
+        return None, None
+
+    header = None
+    cover = None
+    if not legacy:
+        with z_file.open(filename) as fb2:
+            with stage("fb2.header"):
+                header = get_fb2header(fb2)
+            if header is not None:
+                descr, bs_anno, stream = header
+                info = get_struct_by_key('title-info', descr)  # descr['title-info']
+                # continue reading of the same decompressed stream
+                with stage("fb2.cover"):
+                    cover = get_book_cover(info, z_file, zip_file, filename, stream, preview)
+        if header is None:
+            logging.debug("streaming parser failed, try BeautifulSoup for %s/%s", zip_file, filename)
+    if header is None:
+        with z_file.open(filename) as fb2:
+            with stage("fb2.header_bs"):
+                header = get_fb2header_bs(fb2, zip_file, filename)
+        if header is None:
+            return None, None
+        descr, bs_anno = header
+        info = get_struct_by_key('title-info', descr)  # descr['title-info']
+        with stage("fb2.cover_bs"):
+            cover = get_book_cover(info, z_file, zip_file, filename, preview=preview)
+
+    with stage("fb2.record"):
+        isbn, pub_year, publisher = get_pub_info(get_pubinfo(descr, zip_file, filename))
+        pub_info = {
+            "isbn": isbn,
+            "year": pub_year,
+            "publisher": publisher,
+            "publisher_id": make_id(publisher)
+        }
+        book_path = str(os.path.basename(z_file.filename)) + "/" + filename
+        book_id = make_id(book_path, name_as_is=True)
+        out = make_book_record(
+            zip_file, filename, book_id, date_time, size, info, bs_anno, cover, pub_info, inpx_data, replace_data
+        )
     return book_id, out
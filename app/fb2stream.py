@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""Streaming fb2 reader: metadata from <description> without full document parsing"""
+
+import re
+import lxml.etree as et
+
+FB2_NS = "http://www.gribuser.ru/xml/fictionbook/2.0"
+FB2_READ_CHUNK = 16384  # bytes per read from fb2 file object
+FB2_DESCR_LIMIT = 1048576  # give up, if no </description> in first 1MB
+
+XMLNS_RE = re.compile(r' xmlns(:[\w.-]+)?="[^"]*"')
+BINARY_TAG_RE = re.compile(rb'<(?:[\w.-]+:)?binary\b([^>]*)>')
+BINARY_END_RE = re.compile(rb'</(?:[\w.-]+:)?binary\s*>')
+ATTR_ID_RE = re.compile(rb'\bid\s*=\s*["\']([^"\']*)["\']')
+ATTR_CTYPE_RE = re.compile(rb'\bcontent-type\s*=\s*["\']([^"\']*)["\']')
+XML_ENCODING_RE = re.compile(rb'^(?:\xef\xbb\xbf)?<\?xml[^>]*\bencoding\s*=\s*["\']([\w.:-]+)["\']')
+
+
+class Fb2Stream:
+    """
+    iterparse-like event stream over opened fb2 file object
+
+    Data is read and fed to lxml pull parser by small chunks,
+    so reading may be stopped right after needed element
+    and resumed later from the same place without re-reading.
+    Encoding declarations (windows-1251 and other) are handled by libxml2.
+    """
+
+    def __init__(self, fb2_fd):
+        self.fb2_fd = fb2_fd
+        self.parser = et.XMLPullParser(
+            events=("start", "end"),
+            recover=True,
+            huge_tree=True,
+            remove_comments=True,
+            remove_pis=True,
+            no_network=True
+        )
+        self.bytes_read = 0
+        self.depth = 0
+        self.root = None
+        self.eof = False
+        self.first_chunk = b""
+        self.last_chunk = b""
+
+    def events(self, limit=None):
+        """yield (event, element, depth) tuples, depth of root element is 0"""
+        while True:
+            for event, elem in self.parser.read_events():
+                if event == "start":
+                    if self.root is None:
+                        self.root = elem
+                    self.depth += 1
+                    yield event, elem, self.depth - 1
+                else:
+                    self.depth -= 1
+                    yield event, elem, self.depth
+            if self.eof or (limit is not None and self.bytes_read >= limit):
+                return
+            chunk = self.fb2_fd.read(FB2_READ_CHUNK)
+            if not chunk:
+                self.eof = True
+                try:
+                    self.parser.close()
+                except et.XMLSyntaxError:
+                    pass
+                continue
+            if self.bytes_read == 0:
+                self.first_chunk = chunk
+            self.bytes_read += len(chunk)
+            self.last_chunk = chunk
+            self.parser.feed(chunk)
+
+    def description(self):
+        """return <description> element (with all content) or None for non-fb2 data"""
+        for event, elem, depth in self.events(limit=FB2_DESCR_LIMIT):
+            if depth == 0 and event == "start" and local_name(elem) != "FictionBook":
+                return None
+            if depth == 1 and event == "end" and local_name(elem) == "description":
+                return elem
+        return None
+
+    def encoding(self) -> str:
+        """document encoding by BOM or xml declaration"""
+        head = self.first_chunk[:4]
+        if head.startswith((b"\xff\xfe", b"\xfe\xff", b"<\x00", b"\x00<")):
+            return "utf-16"
+        match = XML_ENCODING_RE.match(self.first_chunk)
+        if match is None:
+            return "utf-8"
+        return match.group(1).decode("ascii")
+
+    def binary(self, binary_id: str):
+        """
+        return {"@id": ..., "@content-type": ..., "#text": ...} for <binary> with given id or None,
+        reading is continued from the place where previous reading (i.e. description()) stopped,
+        <body> content is skipped as raw bytes without parsing, reading is stopped on found binary
+        """
+        encoding = self.encoding().upper()
+        if encoding.startswith(("UTF-16", "UTF-32", "UCS")):  # not ascii-compatible, no raw search
+            return self.binary_parsed(binary_id)
+        try:
+            want_id = binary_id.encode(encoding)
+        except (LookupError, UnicodeError):
+            return self.binary_parsed(binary_id)
+        buf = self.last_chunk
+        pos = 0
+        while True:
+            match = BINARY_TAG_RE.search(buf, pos)
+            if match is not None:
+                attr_id = ATTR_ID_RE.search(match.group(1))
+                if attr_id is not None and attr_id.group(1) == want_id:
+                    return self.binary_content(buf, match, binary_id)
+                pos = match.end()
+                continue
+            # no complete <binary ...> tag in buffer, keep possible tag beginning only
+            tag_start = buf.rfind(b"<", pos)
+            buf = buf[tag_start:] if tag_start >= 0 else b""
+            pos = 0
+            chunk = self.read_raw()
+            if not chunk:
+                return None
+            buf = buf + chunk
+
+    def binary_content(self, buf: bytes, match, binary_id: str):
+        """return struct for <binary> started by match in buf, read until </binary>"""
+        ret = {"@id": binary_id}
+        ctype = ATTR_CTYPE_RE.search(match.group(1))
+        if ctype is not None:
+            ret["@content-type"] = ctype.group(1).decode("ascii", errors="replace")
+        start = match.end()
+        end = BINARY_END_RE.search(buf, start)
+        while end is None:
+            chunk = self.read_raw()
+            if not chunk:
+                break
+            buf = buf + chunk
+            end = BINARY_END_RE.search(buf, max(start, len(buf) - len(chunk) - 16))
+        text = buf[start:end.start() if end is not None else len(buf)]
+        text = text.decode("ascii", errors="ignore").strip()
+        if text != "":
+            ret["#text"] = text
+        return ret
+
+    def read_raw(self) -> bytes:
+        """read next chunk of data without parsing"""
+        if self.eof:
+            return b""
+        chunk = self.fb2_fd.read(FB2_READ_CHUNK * 4)
+        if not chunk:
+            self.eof = True
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def binary_parsed(self, binary_id: str):
+        """binary() for documents in ascii-incompatible encoding: parse rest of document, drop parsed elements"""
+        for event, elem, depth in self.events():
+            if event != "end" or depth < 1:
+                continue
+            if depth == 1:
+                if local_name(elem) == "binary" and elem.get("id") == binary_id:
+                    return element_to_dict(elem, depth)
+                elem.clear(keep_tail=False)
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+            else:
+                elem.clear(keep_tail=False)
+        return None
+
+
+def local_name(elem) -> str:
+    """element tag without namespace"""
+    tag = elem.tag
+    if tag[0] == "{":
+        return tag[tag.index("}") + 1:]
+    return tag
+
+
+def tag_name(elem) -> str:
+    """element name as xmltodict return it: fb2 elements without prefix, other with document prefix"""
+    tag = elem.tag
+    if tag[0] != "{":
+        return tag
+    namespace, name = tag[1:].split("}", 1)
+    if namespace != FB2_NS and elem.prefix is not None:
+        return elem.prefix + ":" + name
+    return name
+
+
+def attr_name(elem, key: str) -> str:
+    """attribute name with document prefix, i.e. '@l:href' for xlink href"""
+    if key[0] != "{":
+        return "@" + key
+    namespace, name = key[1:].split("}", 1)
+    for prefix, uri in elem.nsmap.items():
+        if uri == namespace and prefix is not None:
+            return "@" + prefix + ":" + name
+    return "@" + name
+
+
+def element_to_dict(elem, depth: int = 0):
+    """
+    convert element to struct like xmltodict.parse(BeautifulSoup(...).prettify()) do:
+    attributes as '@name', text as '#text' or plain string, repeated elements as list,
+    empty element as None
+    """
+    ret = {}
+    for key, val in elem.attrib.items():
+        ret[attr_name(elem, key)] = val
+    # prettify() put every text piece and tag on own line with indentation,
+    # xmltodict join text pieces of element with those newlines
+    indent = "\n" + " " * (depth + 1)
+    texts = []
+    if elem.text is not None and elem.text.strip() != "":
+        texts.append(elem.text.strip())
+    for child in elem:
+        if not isinstance(child.tag, str):  # unresolved entity
+            if child.tail is not None and child.tail.strip() != "":
+                texts.append(child.tail.strip())
+            continue
+        texts.append("")
+        name = tag_name(child)
+        value = element_to_dict(child, depth + 1)
+        if name in ret:
+            if isinstance(ret[name], list):
+                ret[name].append(value)
+            else:
+                ret[name] = [ret[name], value]
+        else:
+            ret[name] = value
+        if child.tail is not None and child.tail.strip() != "":
+            texts.append(child.tail.strip())
+    text = indent.join(texts).strip()
+    if len(ret) == 0:
+        return text if text != "" else None
+    if text != "":
+        ret["#text"] = text
+    return ret
+
+
+def annotation_to_str(annotation) -> str:
+    """inner xml of <annotation> element without namespaces, as str(BeautifulSoup tag) do"""
+    if annotation is None:
+        return "None"
+    ret = []
+    if annotation.text is not None:
+        ret.append(escape_text(annotation.text))
+    for child in annotation:
+        for elem in child.iter():
+            if isinstance(elem.tag, str) and elem.tag.startswith("{" + FB2_NS + "}"):
+                elem.tag = local_name(elem)
+        et.cleanup_namespaces(child)
+        ret.append(XMLNS_RE.sub("", et.tostring(child, encoding="unicode", with_tail=True)))
+    return "".join(ret)
+
+
+def escape_text(text: str) -> str:
+    """xml escape for text node"""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def find_first(elem, name: str):
+    """first descendant (not elem itself) with local name"""
+    for child in elem.iterdescendants():
+        if isinstance(child.tag, str) and local_name(child) == name:
+            return child
+    return None
+
+
+def get_fb2header(fb2_fd):
+    """
+    return (description struct, annotation xml string, stream)
+    or None if fb2_fd content is not parsed as fb2,
+    stream may be used for reading rest of the file
+    """
+    stream = Fb2Stream(fb2_fd)
+    descr_elem = stream.description()
+    if descr_elem is None:
+        return None
+    tinfo = find_first(descr_elem, "title-info")
+    anno = annotation_to_str(find_first(tinfo, "annotation")) if tinfo is not None else "None"
+    descr = element_to_dict(descr_elem, 1)
+    if not isinstance(descr, dict):
+        descr = {}
+    return descr, anno, stream
@@ -2,7 +2,8 @@
 """create static data for authors/sequences/genres"""
 
 import logging
-import glob
+import os
+import time
 import json
 # import base64
 import shutil
@@ -13,8 +14,10 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy import func
 
 from .config import CONFIG
+from .booklist import booklists, booklist_base, open_booklist, book_from_line, CoversReader
+from .trace import stage, add_books, add_zip_time
+from .covers import store_cover
 from .data import (
-    open_booklist,
     seqs_in_data,
     nonseq_from_data,
     refine_book,
@@ -77,10 +80,10 @@ def make_auth_data(session):
     authordir = URL["author"].replace("/opds", "", 1)
 
     auth_data = {}
-    for booklist in sorted(glob.glob(zipdir + '/*.zip.list') + glob.glob(zipdir + '/*.zip.list.gz')):
+    for booklist in booklists(zipdir):
         with open_booklist(booklist) as lst:
             for b in lst:
-                book = json.loads(b)
+                book = book_from_line(b)
                 if book is None:
                     continue
                 if hide_deleted == "yes" and "deleted" in book and book["deleted"] != 0:
@@ -203,25 +206,33 @@ def make_book_struct():
     hide_deleted = CONFIG['HIDE_DELETED']
 
     i = 0
-    for booklist in sorted(glob.glob(zipdir + '/*.zip.list') + glob.glob(zipdir + '/*.zip.list.gz')):
+    for booklist in booklists(zipdir):
         logging.info("[%s] %s", str(i), booklist)
-        with open_booklist(booklist) as lst:
+        start = time.monotonic()
+        with open_booklist(booklist) as lst, CoversReader(booklist_base(booklist)) as covers:
             count = 0
             lines = lst.readlines(int(CONFIG['PASS_SIZE_HINT']))
             while len(lines) > 0:
                 count = count + len(lines)
                 logging.debug("   %s", count)
-                make_book_struct_data(lines, books_struct_dir, hide_deleted)
+                with stage("books.write"):
+                    make_book_struct_data(lines, books_struct_dir, hide_deleted, covers)
                 lines = lst.readlines(int(CONFIG['MAX_PASS_LENGTH']))
+        add_books(booklist, count, os.path.getsize(booklist))
+        add_zip_time(booklist, time.monotonic() - start)
         i = i + 1
     shutil.copy(CONFIG['DEFAULT_COVER_SRC'], pagesdir + CONFIG['DEFAULT_COVER'])
     logging.info("end")
 
 
-def make_book_struct_data(lines, books_struct_dir, hide_deleted="no"):
-    """write book info and covers previews from jsonl lines data"""
+def make_book_struct_data(lines, books_struct_dir, hide_deleted="no", covers=None):
+    """
+    write book info and covers previews (to covers store) from jsonl lines data,
+    covers is CoversReader for booklist with covers in sidecar
+    """
+    pagesdir = CONFIG['PAGES']
     for line in lines:
-        book = json.loads(line)
+        book = book_from_line(line)
         if book is None or (hide_deleted == "yes" and "deleted" in book and book["deleted"] == 1):
             continue
         if book is not None and book['book_id'] is not None:
@@ -233,19 +244,27 @@ def make_book_struct_data(lines, books_struct_dir, hide_deleted="no"):
             if "cover" in book and book["cover"] is not None:
                 cover = book["cover"]
                 # cover_ctype = cover["content-type"]
-                cover_data = cover["data"]
                 try:
-                    img_bytes = decode_b64(cover_data)
-                    with open(workdir + '/' + book_id + '.jpg', 'wb') as img:
-                        img.write(img_bytes)
+                    if "ref" in cover:
+                        img_bytes = covers.read(cover["ref"])
+                    else:
+                        img_bytes = decode_b64(cover["data"])
+                    # the same image for many books is stored once
+                    book["cover_id"] = store_cover(pagesdir, img_bytes)
                 except Exception as ex:
                     logging.error('image error in %s/%s: %s', zip_file, filename, ex)
+            if "cover" in book:
                 del book["cover"]
             try:
                 with open(workdir + '/' + book_id + ".json", "w") as b:
                     json.dump(book, b, indent=2, ensure_ascii=False)
             except Exception as ex:
                 logging.error("Can't write book data: %s", ex)
+            try:
+                # legacy per-book cover (before covers store) is stale now
+                os.unlink(workdir + '/' + book_id + ".jpg")
+            except FileNotFoundError:
+                pass
 
 
 def make_sequencesindex():
@@ -276,10 +295,10 @@ def make_seq_data(session):
     seqdir = URL["seq"].replace("/opds", "", 1)
 
     seq_data = {}
-    for booklist in sorted(glob.glob(zipdir + '/*.zip.list') + glob.glob(zipdir + '/*.zip.list.gz')):
+    for booklist in booklists(zipdir):
         with open_booklist(booklist) as lst:
             for b in lst:
-                book = json.loads(b)
+                book = book_from_line(b)
                 if book is None:
                     continue
                 if hide_deleted == "yes" and "deleted" in book and book["deleted"] != 0:
@@ -403,10 +422,10 @@ def make_genres_data(session):
 
     gen_data = {}
     gen_names = {}
-    for booklist in sorted(glob.glob(zipdir + '/*.zip.list') + glob.glob(zipdir + '/*.zip.list.gz')):
+    for booklist in booklists(zipdir):
         with open_booklist(booklist) as lst:
             for b in lst:
-                book = json.loads(b)
+                book = book_from_line(b)
                 if book is None:
                     continue
                 if hide_deleted == "yes" and "deleted" in book and book["deleted"] != 0:
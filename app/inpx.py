@@ -4,10 +4,18 @@
 import zipfile
 import os
 import logging
+import json
+import struct
+import zlib
 
 # pylint: disable=relative-beyond-top-level
 from .strings import strip_quotes, num2int
 
+INPX_INDEX_VERSION = 1
+INPX_INDEX_LEN_FMT = "<Q"  # header length in index file
+
+INPX_INDEX = {}  # loaded index header, see load_inpx_index()
+
 
 def array_strip_empty(arr):
     """cleanup empty strings from array of strings"""
@@ -113,26 +121,119 @@ def get_line_fields(line: str):
         return None, None
 
 
-def get_inpx_meta(inpx_data, zip_file):
-    """retrieve data from entire .inpx file"""
+def parse_inp(data: str):
+    """return {"file.fb2": meta, ...} for .inp file content"""
     ret = {}
-    inp_file = os.path.basename(zip_file).replace(".zip", ".inp")
+    for line in data.split("\n"):
+        fb2, meta = get_line_fields(line)
+        if fb2 is not None:
+            ret[fb2] = meta
+    return ret
+
+
+def inpx_index_path(inpx_data: str) -> str:
+    """sidecar index filename for .inpx"""
+    return inpx_data + ".idx"
 
+
+def build_inpx_index(inpx_data: str):
+    """
+    parse every .inp in .inpx once and write sidecar index:
+    8 bytes of header length, json header with .inpx mtime/size and per-archive offsets,
+    then zlib-compressed json {"file.fb2": meta, ...} block for every archive
+    return header struct
+    """
+    logging.info("Building inpx index for %s", inpx_data)
+    stat = os.stat(inpx_data)
+    archives = {}
+    blocks = []
+    offset = 0
+    with zipfile.ZipFile(inpx_data) as inpx_zip:
+        for inp_file in inpx_zip.namelist():
+            if not inp_file.endswith(".inp"):
+                continue
+            meta = parse_inp(inpx_zip.read(inp_file).decode('utf-8'))
+            block = zlib.compress(json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+            archives[os.path.basename(inp_file)[:-4] + ".zip"] = [offset, len(block)]
+            blocks.append(block)
+            offset += len(block)
+    header = {
+        "version": INPX_INDEX_VERSION,
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "archives": archives
+    }
+    header_data = json.dumps(header).encode('utf-8')
+    index_file = inpx_index_path(inpx_data)
+    tmp_file = index_file + ".tmp"
+    with open(tmp_file, "wb") as idx:
+        idx.write(struct.pack(INPX_INDEX_LEN_FMT, len(header_data)))
+        idx.write(header_data)
+        for block in blocks:
+            idx.write(block)
+    os.replace(tmp_file, index_file)
+    logging.info("inpx index: %s archives", len(archives))
+    return header
+
+
+def read_inpx_index_header(index_file: str):
+    """return header of sidecar index or None"""
+    try:
+        with open(index_file, "rb") as idx:
+            header_len = struct.unpack(INPX_INDEX_LEN_FMT, idx.read(struct.calcsize(INPX_INDEX_LEN_FMT)))[0]
+            return json.loads(idx.read(header_len).decode('utf-8'))
+    except Exception as ex:  # pylint: disable=W0703
+        logging.debug("Can't read inpx index %s: %s", index_file, ex)
+    return None
+
+
+def load_inpx_index(inpx_data: str):
+    """
+    return index header for .inpx, index is (re)built if absent or .inpx was changed,
+    header is cached in process
+    """
+    if INPX_INDEX.get("inpx") == inpx_data:
+        return INPX_INDEX["header"]
+    header = {"archives": {}}
+    if os.path.isfile(inpx_data):
+        stat = os.stat(inpx_data)
+        index_file = inpx_index_path(inpx_data)
+        cached = read_inpx_index_header(index_file)
+        if (
+            cached is not None and cached.get("version") == INPX_INDEX_VERSION and
+            cached.get("mtime") == stat.st_mtime and cached.get("size") == stat.st_size
+        ):
+            header = cached
+        else:
+            try:
+                header = build_inpx_index(inpx_data)
+            except Exception as ex:  # pylint: disable=W0703
+                logging.exception("Error in building inpx index for %s: %s", inpx_data, str(ex))
+    else:
+        logging.warning("No inpx file: %s", inpx_data)
+    INPX_INDEX["inpx"] = inpx_data
+    INPX_INDEX["header"] = header
+    return header
+
+
+def get_inpx_meta(inpx_data, zip_file):
+    """retrieve data for zip_file from .inpx index"""
+    ret = {}
+    archive = os.path.basename(zip_file)
+    header = load_inpx_index(inpx_data)
+    if archive not in header["archives"]:
+        logging.debug("No inpx data for %s", archive)
+        return ret
+    offset, length = header["archives"][archive]
     try:
-        # pylint: disable=R1732
-        inpx_zip = zipfile.ZipFile(inpx_data)
-        f_inpx = inpx_zip.open(inp_file, "r")
-        data = f_inpx.read().decode('utf-8')
-        lines = data.split("\n")
-        for line in lines:
-            fb2, meta = get_line_fields(line)
-            ret.update({fb2: meta})
-            line = f_inpx.readline().decode('utf-8').strip("\r").strip("\n")
-        f_inpx.close()
+        with open(inpx_index_path(inpx_data), "rb") as idx:
+            header_len = struct.unpack(INPX_INDEX_LEN_FMT, idx.read(struct.calcsize(INPX_INDEX_LEN_FMT)))[0]
+            idx.seek(struct.calcsize(INPX_INDEX_LEN_FMT) + header_len + offset)
+            ret = json.loads(zlib.decompress(idx.read(length)).decode('utf-8'))
     except Exception as ex:  # pylint: disable=W0703
         logging.exception(
             "Error in getting metadata: %s for file: %s",
             str(ex),
-            os.path.basename(zip_file)
+            archive
         )
     return ret
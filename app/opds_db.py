@@ -12,6 +12,8 @@ from .db import (
     get_books_descr,
     get_authors,
     get_seqs,
+    get_books_seqs,
+    get_random_books,
     get_ids_nearest
 )
 from .data import get_vector
@@ -86,14 +88,9 @@ def opds_books_db(params):
     try:
         session = dbsession()
         if layout == "rnd_books":
-            books_data = session.query(Book).order_by(func.random()).limit(pagelimit).all()
+            books_data = get_random_books(session, pagelimit)
         elif layout == "rnd_books_genre":
-            gen_id = params["gen_id"]
-            books_data = session.query(
-                Book
-            ).filter(
-                Book.genres.any(gen_id)
-            ).order_by(func.random()).limit(pagelimit).all()
+            books_data = get_random_books(session, pagelimit, params["gen_id"])
         elif layout == "search_book":
             s_term = params["search_term"]
             ret["feed"]["id"] = tag + urllib.parse.quote_plus(s_term)
@@ -170,6 +167,7 @@ def opds_books_db(params):
             for s in b.sequences:
                 seqids.append(s)
         descr = get_books_descr(session, book_ids)
+        seq_links = get_books_seqs(session, book_ids)
         authors = get_authors(session, authorids)
         sequences = get_seqs(session, seqids)
         for book_id in books:
@@ -191,11 +189,15 @@ def opds_books_db(params):
                 if a in authors:
                     book_authors.append(authors[a])
             book["authors"] = book_authors
-            seq_ids = book["sequences"]
+            # links have number of book in sequence, books.sequences -- for books without links yet
+            seq_ids = seq_links.get(book_id, [{"id": s, "num": None} for s in book["sequences"]])
             book_seqs = []
             for s in seq_ids:
-                if s in sequences:
-                    book_seqs.append(sequences[s])
+                if s["id"] in sequences:
+                    seq = dict(sequences[s["id"]])
+                    if s["num"] is not None:
+                        seq["num"] = s["num"]
+                    book_seqs.append(seq)
             book["sequences"] = book_seqs
             books[book_id] = book
     except Exception as ex:
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""stage timings and throughput report for datachew runs (--trace)"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+# enabled: collect data, commands: finished commands reports, current: data of running command
+TRACE = {
+    "enabled": False,
+    "commands": [],
+    "current": None
+}
+TRACE_LOCK = threading.Lock()
+
+
+def new_trace_data():
+    """empty struct for collected data"""
+    return {
+        "pid": os.getpid(),  # collecting process, see take_trace()
+        "stages": {},  # {name: [count, seconds], ...}
+        "zips": {}  # {zip: {"books": .., "bytes": .., "seconds": .., "latencies": [...]}, ...}
+    }
+
+
+def trace_enable():
+    """start collecting data"""
+    TRACE["enabled"] = True
+    TRACE["current"] = new_trace_data()
+
+
+def trace_enabled() -> bool:
+    """collecting is on"""
+    return TRACE["enabled"]
+
+
+@contextmanager
+def stage(name: str):
+    """time code block as stage `name`"""
+    if not TRACE["enabled"]:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start)
+
+
+def add_stage(name: str, seconds: float, count: int = 1):
+    """add stage timing"""
+    with TRACE_LOCK:  # stages are timed in preview threads too
+        stages = TRACE["current"]["stages"]
+        if name not in stages:
+            stages[name] = [0, 0.0]
+        stages[name][0] += count
+        stages[name][1] += seconds
+
+
+def zip_data(zip_file: str):
+    """collected data for zip"""
+    zips = TRACE["current"]["zips"]
+    if zip_file not in zips:
+        zips[zip_file] = {"books": 0, "bytes": 0, "seconds": 0.0, "latencies": []}
+    return zips[zip_file]
+
+
+def add_book(zip_file: str, seconds: float, size: int, is_book: bool = True):
+    """add timing of one member from zip, which is counted as book if it is parsed to book"""
+    if not TRACE["enabled"]:
+        return
+    data = zip_data(zip_file)
+    if is_book:
+        data["books"] += 1
+    data["bytes"] += size
+    data["latencies"].append(seconds)
+
+
+def add_books(zip_file: str, books: int, size: int):
+    """add count of books from zip without per-book timings (i.e. batch processing)"""
+    if not TRACE["enabled"]:
+        return
+    data = zip_data(zip_file)
+    data["books"] += books
+    data["bytes"] += size
+
+
+def add_zip_time(zip_file: str, seconds: float):
+    """add wall time of zip processing"""
+    if not TRACE["enabled"]:
+        return
+    zip_data(zip_file)["seconds"] += seconds
+
+
+def reset_trace():
+    """
+    drop data inherited by forked worker process from parent (parent has it already),
+    must be called at worker start, before first take_trace()
+    """
+    if TRACE["enabled"]:
+        TRACE["current"] = new_trace_data()
+
+
+def check_zip_books(zip_file: str, books: int) -> bool:
+    """
+    compare books counted for zip (with data merged from its workers) with books written to its .list,
+    log error on mismatch (i.e. data of workers is counted twice)
+    """
+    if not TRACE["enabled"]:
+        return True
+    traced = zip_data(zip_file)["books"]
+    if traced != books:
+        logging.error("trace: %s books counted for %s, but %s parsed books written to list", traced, zip_file, books)
+        return False
+    return True
+
+
+def take_trace():
+    """return data collected in worker process and reset it, None if tracing is off"""
+    if not TRACE["enabled"]:
+        return None
+    ret = TRACE["current"]
+    TRACE["current"] = new_trace_data()
+    if ret["pid"] != os.getpid():
+        # data of parent process is in it, parent would count it twice
+        logging.error("trace: worker %s did not reset trace data inherited from parent, data dropped", os.getpid())
+        return None
+    return ret
+
+
+def merge_trace(data):
+    """add data from worker process (see take_trace())"""
+    if data is None or not TRACE["enabled"]:
+        return
+    for name, (count, seconds) in data["stages"].items():
+        add_stage(name, seconds, count)
+    for zip_file, zdata in data["zips"].items():
+        current = zip_data(zip_file)
+        current["books"] += zdata["books"]
+        current["bytes"] += zdata["bytes"]
+        current["seconds"] += zdata["seconds"]
+        current["latencies"].extend(zdata["latencies"])
+
+
+@contextmanager
+def command(name: str):
+    """collect data for datachew command, data of nested command is added to outer one too"""
+    if not TRACE["enabled"]:
+        yield
+        return
+    outer = TRACE["current"]
+    TRACE["current"] = new_trace_data()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        data = TRACE["current"]
+        TRACE["commands"].append(command_report(name, time.perf_counter() - start, data))
+        TRACE["current"] = outer
+        merge_trace(data)
+
+
+def percentiles(values):
+    """p50/p90/p99/max of values in milliseconds or None"""
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    ret = {}
+    for name, part in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        ret[name] = round(values[min(len(values) - 1, int(part * len(values)))] * 1000, 3)
+    ret["max"] = round(values[-1] * 1000, 3)
+    return ret
+
+
+def throughput(books, size, seconds):
+    """books/sec and bytes/sec"""
+    return {
+        "books_per_sec": round(books / seconds, 1) if seconds > 0 else None,
+        "bytes_per_sec": round(size / seconds, 1) if seconds > 0 else None
+    }
+
+
+def command_report(name, seconds, data):
+    """report struct for command"""
+    books = 0
+    size = 0
+    latencies = []
+    zips = {}
+    for zip_file, zdata in sorted(data["zips"].items()):
+        books += zdata["books"]
+        size += zdata["bytes"]
+        latencies.extend(zdata["latencies"])
+        zips[zip_file] = {
+            "books": zdata["books"],
+            "bytes": zdata["bytes"],
+            "seconds": round(zdata["seconds"], 3),
+            "latency_ms": percentiles(zdata["latencies"])
+        }
+        zips[zip_file].update(throughput(zdata["books"], zdata["bytes"], zdata["seconds"]))
+    ret = {
+        "command": name,
+        "seconds": round(seconds, 3),
+        "books": books,
+        "bytes": size,
+        "latency_ms": percentiles(latencies),
+        "stages": {
+            stage_name: {
+                "count": count,
+                "seconds": round(stage_seconds, 3),
+                "avg_ms": round(stage_seconds / count * 1000, 3) if count > 0 else None
+            }
+            for stage_name, (count, stage_seconds) in sorted(data["stages"].items())
+        },
+        "zips": zips
+    }
+    ret.update(throughput(books, size, seconds))
+    return ret
+
+
+def trace_write(filename: str):
+    """write json report of finished commands"""
+    with open(filename, "w", encoding="utf-8") as out:
+        json.dump({"commands": TRACE["commands"]}, out, indent=2, ensure_ascii=False)
+    for report in TRACE["commands"]:
+        logging.info(
+            "trace: %s %.2fs, %s books, %s books/s",
+            report["command"], report["seconds"], report["books"], report["books_per_sec"]
+        )
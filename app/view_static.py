@@ -29,6 +29,7 @@ from .validate import (
 )
 from .config import CONFIG, URL, LANG, XSL_READ
 from .data import is_auth
+from .covers import find_cover
 
 static = Blueprint("static", __name__)
 
@@ -142,17 +143,14 @@ def fb2_cover(sub1=None, sub2=None, book_id=None):
         return Response("Cover not found", status=404)
 
     pagesdir = CONFIG['PAGES']
-    coverfile = safe_path("%s%s/%s/%s.jpg" % (
-        URL["cover"],
-        sub1,
-        sub2,
-        book_id
-    ))
-
-    fullpath = os.path.join(pagesdir, coverfile)
-
-    if os.path.isfile(fullpath):
-        return send_file(fullpath, mimetype='image/jpeg', max_age=max_age)
+    if sub1 == book_id[:2] and sub2 == book_id[2:4]:
+        cover = find_cover(pagesdir, book_id)
+        if cover is not None:
+            # etag by image hash: the same for all books with the same image in store
+            etag, data = cover
+            if isinstance(data, bytes):  # from packed store
+                data = BytesIO(data)
+            return send_file(data, mimetype='image/jpeg', max_age=max_age, etag=etag)
     coverfile = safe_path(CONFIG['DEFAULT_COVER'])
     fullpath = os.path.join(pagesdir, coverfile)
     return send_file(fullpath, mimetype='image/jpeg', max_age=max_age)
@@ -3,14 +3,26 @@
 
 import logging
 import zipfile
+import hashlib
+import multiprocessing
+import multiprocessing.connection
+import resource
 import glob
 import os
 import sys
 import json
+import time
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, as_completed
 
 from .config import CONFIG
-from .inpx import get_inpx_meta
-from .fb2int import fb2parse
+from .inpx import get_inpx_meta, load_inpx_index
+from .fb2int import fb2parse, make_cover_preview
+from .trace import stage, trace_enabled, add_book, add_zip_time, take_trace, merge_trace, reset_trace, check_zip_books
+from .booklist import BooklistWriter, find_booklist, open_booklist, book_from_line, booklist_supported
+
+BOOKS_CHUNK = 16  # books per task in parallel parsing of single .zip
 
 
 def get_genres_replaces():
@@ -82,63 +94,487 @@ def list_zip(zip_file):
     return ret
 
 
-def create_booklist(inpx_data, zip_file) -> None:  # pylint: disable=C0103
-    """(re)create .list from .zip"""
+def get_replaces():
+    """return genres/langs data for refine_book_genres_lang()"""
+    return {
+        "genres": get_genres_list(),
+        "genres_replace": get_genres_replaces(),
+        "langs_replace": get_langs_replaces()
+    }
+
+
+def refine_book_genres_lang(book, replaces):
+    """replace unknown genres and langs in book struct"""
+    genres_list = replaces["genres"]
+    genres_replacements = replaces["genres_replace"]
+    langs_replacements = replaces["langs_replace"]
+    if "genres" in book and book["genres"] is not None and len(book["genres"]) > 0:
+        book_genres = book["genres"]
+        new_genres = []
+        for genre in book_genres:
+            if genre not in genres_list and genre != "":
+                if genre in genres_replacements:
+                    new_genres.append(genres_replacements[genre])
+                else:
+                    new_genres.append('other')
+            else:
+                new_genres.append(genre)
+        book["genres"] = new_genres
+    else:
+        book["genres"] = ['other']
+    if "lang" in book and book["lang"] != "":
+        lang = book["lang"]
+        if lang in langs_replacements:
+            book["lang"] = langs_replacements[lang]
+    else:
+        book["lang"] = 'en'
+    return book
+
+
+class BookFailure:  # pylint: disable=R0903
+    """returned by parse_book() instead of book struct for book, which parsing raised exception"""
+
+    def __init__(self, filename, error):
+        self.filename = filename
+        self.error = error
+
 
-    genres_list = get_genres_list()
-    genres_replacements = get_genres_replaces()
-    langs_replacements = get_langs_replaces()
-    booklist = zip_file + ".list"
-    booklistgz = zip_file + ".list.gz"
-    if os.path.exists(booklistgz):
-        os.remove(booklistgz)  # fix simultaneous .list and .list.gz
+def parse_book(z_file, zip_file, filename, replace_data, inpx_meta, replaces, preview=True):
+    """return refined book struct for filename in opened zip, None for not a book or BookFailure"""
+    # pylint: disable=R0913
+    logging.debug("%s/%s            ", zip_file, filename)
+    start = time.perf_counter()
+    ret = None
     try:
-        with open(booklist, 'w', encoding='utf-8') as blist:
-            files = list_zip(zip_file)
-            z_file = zipfile.ZipFile(zip_file)  # pylint: disable=R1732
-            inpx_meta = get_inpx_meta(inpx_data, zip_file)
-            replace_data = get_replace_list(zip_file)
+        _, book = fb2parse(z_file, filename, replace_data, inpx_meta, preview=preview)
+        if book is not None:
+            ret = refine_book_genres_lang(book, replaces)
+    except Exception as ex:  # pylint: disable=W0703
+        logging.error("error processing %s/%s: %s", zip_file, filename, ex)
+        ret = BookFailure(filename, "%s: %s" % (type(ex).__name__, ex))
+    if trace_enabled():
+        add_book(
+            zip_file, time.perf_counter() - start, z_file.getinfo(filename).file_size,
+            is_book=ret is not None and not isinstance(ret, BookFailure)
+        )
+    return ret
 
-            for filename in files:
-                logging.debug("%s/%s            ", zip_file, filename)
-                try:
-                    _, book = fb2parse(z_file, filename, replace_data, inpx_meta)
-                    if book is None:
-                        continue
-                    if "genres" in book and book["genres"] is not None and len(book["genres"]) > 0:
-                        book_genres = book["genres"]
-                        new_genres = []
-                        for genre in book_genres:
-                            if genre not in genres_list and genre != "":
-                                if genre in genres_replacements:
-                                    new_genres.append(genres_replacements[genre])
-                                else:
-                                    new_genres.append('other')
-                            else:
-                                new_genres.append(genre)
-                        book["genres"] = new_genres
-                    else:
-                        book["genres"] = ['other']
-                    if "lang" in book and book["lang"] != "":
-                        lang = book["lang"]
-                        if lang in langs_replacements:
-                            book["lang"] = langs_replacements[lang]
-                    else:
-                        book["lang"] = 'en'
-                    blist.write(json.dumps(book, ensure_ascii=False))  # jsonl in blist
-                    blist.write("\n")
-                except Exception as ex:
-                    logging.error("error processing %s/%s: %s", zip_file, filename, ex)
+
+# per-process state of books parsing pool, filled by parse_books_init()
+BOOKS_WORKER = {}
+
+
+def parse_books_init(zip_file, replace_data, inpx_meta, preview):
+    """books parsing pool initializer: open .zip once per worker process"""
+    reset_trace()
+    BOOKS_WORKER["z_file"] = zipfile.ZipFile(zip_file)  # pylint: disable=R1732
+    BOOKS_WORKER["zip_file"] = zip_file
+    BOOKS_WORKER["replace_data"] = replace_data
+    BOOKS_WORKER["inpx_meta"] = inpx_meta
+    BOOKS_WORKER["replaces"] = get_replaces()
+    BOOKS_WORKER["preview"] = preview
+
+
+def parse_books_task(filename):
+    """books parsing pool task: decompress and parse one book in worker process, return (book, trace data)"""
+    book = parse_book(
+        BOOKS_WORKER["z_file"],
+        BOOKS_WORKER["zip_file"],
+        filename,
+        BOOKS_WORKER["replace_data"],
+        BOOKS_WORKER["inpx_meta"],
+        BOOKS_WORKER["replaces"],
+        BOOKS_WORKER["preview"]
+    )
+    return book, take_trace()
+
+
+def iter_books(zip_file, files, replace_data, inpx_meta, preview=True):
+    """yield parsed books (or None for skipped) in files order"""
+    z_file = zipfile.ZipFile(zip_file)  # pylint: disable=R1732
+    replaces = get_replaces()
+    for filename in files:
+        yield parse_book(z_file, zip_file, filename, replace_data, inpx_meta, replaces, preview)
+
+
+def iter_books_parallel(zip_file, files, replace_data, inpx_meta, book_jobs, preview=True):
+    """
+    yield parsed books (or None for skipped) in files order,
+    members are decompressed and parsed in book_jobs worker processes by chunks
+    """
+    # pylint: disable=R0913
+    chunksize = max(1, min(BOOKS_CHUNK, len(files) // (book_jobs * 4)))
+    with ProcessPoolExecutor(
+        max_workers=book_jobs,
+        initializer=parse_books_init,
+        initargs=(zip_file, replace_data, inpx_meta, preview)
+    ) as executor:
+        # map() return results in order of files, so .list content does not depend on workers timing
+        for book, trace_data in executor.map(parse_books_task, files, chunksize=chunksize):
+            merge_trace(trace_data)
+            yield book
+
+
+def book_worker_main(conn, zip_file, replace_data, inpx_meta, preview, memory_mb):
+    """supervised books parsing process: parse filenames from conn until None"""
+    # pylint: disable=R0913
+    reset_trace()
+    if memory_mb > 0:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_mb * 1048576, hard))
+    parse_books_init(zip_file, replace_data, inpx_meta, preview)
+    while True:
+        filename = conn.recv()
+        if filename is None:
+            return
+        conn.send(parse_books_task(filename))
+
+
+class BookWorker:
+    """supervised books parsing process, which may be killed on time budget overrun"""
+
+    def __init__(self, zip_file, replace_data, inpx_meta, preview, memory_mb):
+        # pylint: disable=R0913
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=book_worker_main,
+            args=(child_conn, zip_file, replace_data, inpx_meta, preview, memory_mb),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.index = None
+        self.filename = None
+        self.deadline = None
+
+    def send(self, index, filename, timeout):
+        """start parsing of book"""
+        self.index = index
+        self.filename = filename
+        self.deadline = time.monotonic() + timeout if timeout > 0 else None
+        self.conn.send(filename)
+
+    def overrun(self, now) -> bool:
+        """book is parsed longer than timeout"""
+        return self.deadline is not None and now > self.deadline
+
+    def kill(self):
+        """kill process (i.e. stalled in parsing)"""
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        """stop idle process"""
+        try:
+            self.conn.send(None)
+            self.process.join(1)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+def iter_books_supervised(zip_file, files, replace_data, inpx_meta, book_jobs, preview=True):
+    """
+    yield parsed books (or None for skipped, BookFailure for failed) in files order,
+    books are parsed in book_jobs supervised processes with time (book_timeout)
+    and memory (book_memory_mb) budget per book, process with book over budget
+    is killed and replaced by new one, book is returned as BookFailure
+    """
+    # pylint: disable=R0912,R0913,R0914
+    timeout = float(CONFIG['BOOK_TIMEOUT'])
+    memory_mb = int(CONFIG['BOOK_MEMORY_MB'])
+    window = book_jobs * BOOKS_CHUNK  # max parsed books waiting for yield
+    idle = []
+    busy = []
+    results = {}
+    next_send = 0
+    next_yield = 0
+    try:
+        while next_yield < len(files):
+            while next_send < len(files) and len(busy) < book_jobs and next_send - next_yield < window:
+                worker = idle.pop() if idle else BookWorker(zip_file, replace_data, inpx_meta, preview, memory_mb)
+                worker.send(next_send, files[next_send], timeout)
+                busy.append(worker)
+                next_send += 1
+            if next_yield in results:
+                yield results.pop(next_yield)
+                next_yield += 1
+                continue
+            deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+            wait_time = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+            ready = multiprocessing.connection.wait([worker.conn for worker in busy], wait_time)
+            now = time.monotonic()
+            for worker in list(busy):
+                if worker.conn in ready:
+                    busy.remove(worker)
+                    try:
+                        book, trace_data = worker.conn.recv()
+                        merge_trace(trace_data)
+                        idle.append(worker)
+                    except (EOFError, OSError):  # worker is dead (i.e. killed by OOM killer)
+                        worker.kill()
+                        exitcode = worker.process.exitcode
+                        logging.error("worker died on %s/%s, exit code: %s", zip_file, worker.filename, exitcode)
+                        book = BookFailure(worker.filename, "worker died: exit code %s" % exitcode)
+                    results[worker.index] = book
+                elif worker.overrun(now):
+                    busy.remove(worker)
+                    logging.error("timeout on %s/%s, killing worker", zip_file, worker.filename)
+                    worker.kill()
+                    results[worker.index] = BookFailure(worker.filename, "timeout: more than %ss" % timeout)
+    finally:
+        for worker in idle:
+            worker.stop()
+        for worker in busy:
+            worker.kill()
+
+
+def book_budget_enabled() -> bool:
+    """books must be parsed by supervised workers"""
+    return float(CONFIG['BOOK_TIMEOUT']) > 0 or int(CONFIG['BOOK_MEMORY_MB']) > 0
+
+
+def cover_preview_task(book):
+    """make cover preview for book in thread pool, return book"""
+    context = "%s/%s" % (book["zipfile"], book["filename"])
+    book["cover"] = make_cover_preview(book["cover"], context)
+    return book
+
+
+def iter_previews(books, thumb_jobs):
+    """
+    yield books in the same order, with source covers replaced by previews,
+    previews are made in thread pool (PIL releases GIL in image decoding/resizing) while books parsing
+    """
+    window = thumb_jobs * 4  # max books waiting for preview
+    with ThreadPoolExecutor(max_workers=thumb_jobs) as executor:
+        pending = deque()
+        for book in books:
+            if isinstance(book, dict) and book.get("cover") is not None:
+                pending.append(executor.submit(cover_preview_task, book))
+            else:
+                pending.append(book)
+            while len(pending) > window or (len(pending) > 0 and is_ready(pending[0])):
+                yield get_ready(pending.popleft())
+        while len(pending) > 0:
+            yield get_ready(pending.popleft())
+
+
+def is_ready(item) -> bool:
+    """book or finished preview task"""
+    return not isinstance(item, Future) or item.done()
+
+
+def get_ready(item):
+    """return book from book or preview task"""
+    if isinstance(item, Future):
+        return item.result()
+    return item
+
+
+def zip_members(zip_file):
+    """return {filename: [crc32, size, date_time], ...} from .zip central directory"""
+    ret = {}
+    with zipfile.ZipFile(zip_file) as z_file:
+        for info in z_file.infolist():
+            if not os.path.isdir(info.filename):
+                ret[info.filename] = [info.CRC, info.file_size, list(info.date_time)]
+    return ret
+
+
+def read_manifest(zip_file):
+    """return struct from .zip.manifest or None"""
+    manifest = zip_file + ".manifest"
+    if not os.path.isfile(manifest):
+        return None
+    try:
+        with open(manifest, encoding="utf-8") as mfile:
+            return json.load(mfile)
     except Exception as ex:  # pylint: disable=W0703
-        logging.error("error processing zip_file: %s", ex)
-        logging.info("removing %s", booklist)
-        os.remove(booklist)
-        sys.exit(1)
+        logging.warning("Can't load manifest '%s': %s", manifest, str(ex))
+    return None
+
+
+def write_manifest(zip_file, manifest):
+    """write .zip.manifest with state of .zip and .zip.replace, which .list was made from"""
+    manifest_file = zip_file + ".manifest"
+    with open(manifest_file + ".tmp", 'w', encoding='utf-8') as mfile:
+        json.dump(manifest, mfile, ensure_ascii=False)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def file_sha1(filename):
+    """return sha1 hexdigest of file content or None if no file"""
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "rb") as data:
+        return hashlib.sha1(data.read()).hexdigest()
+
+
+def zip_manifest(zip_file):
+    """return current manifest struct for .zip: members from central directory and .zip.replace hash"""
+    return {
+        "members": zip_members(zip_file),
+        "replace": file_sha1(zip_file + ".replace")
+    }
+
+
+def read_booklist_lines(booklist):
+    """return {filename: jsonl line or record, ...} from booklist in any format"""
+    ret = {}
+    with open_booklist(booklist) as blist:
+        for line in blist:
+            if isinstance(line, str):
+                line = line.rstrip("\n")
+                if line.strip() == "":
+                    continue
+            ret[book_from_line(line)["filename"]] = line
+    return ret
+
+
+def reusable_records(zip_file, members):  # pylint: disable=R0911
+    """
+    return {filename: jsonl line, record or None, ...} of existing .list records for unchanged .zip members
+    or None if .list must be rebuilt from scratch
+    """
+    booklist = find_booklist(zip_file)
+    if booklist is None:
+        return None
+    manifest = read_manifest(zip_file)
+    if manifest is None:
+        return None
+    if manifest.get("replace") != file_sha1(zip_file + ".replace"):
+        return None  # replaces may touch any book
+    old_members = manifest.get("members", {})
+    try:
+        lines = read_booklist_lines(booklist)
+    except Exception as ex:  # pylint: disable=W0703
+        logging.warning("Can't read %s, full rebuild: %s", booklist, ex)
+        return None
+    ret = {}
+    for filename, member in members.items():
+        if old_members.get(filename) == member:
+            ret[filename] = lines.get(filename)  # None for unchanged member without book (not fb2, broken)
+    return ret
+
+
+def read_quarantine(zip_file):
+    """return {filename: {"member": [crc32, size, date_time], "error": "..."}, ...} from .zip.quarantine"""
+    quarantine = zip_file + ".quarantine"
+    if not os.path.isfile(quarantine):
+        return {}
+    try:
+        with open(quarantine, encoding="utf-8") as qfile:
+            return json.load(qfile)
+    except Exception as ex:  # pylint: disable=W0703
+        logging.warning("Can't load quarantine '%s': %s", quarantine, str(ex))
+    return {}
+
+
+def write_quarantine(zip_file, data):
+    """write .zip.quarantine or remove it if nothing is quarantined"""
+    quarantine = zip_file + ".quarantine"
+    if len(data) == 0:
+        if os.path.exists(quarantine):
+            os.remove(quarantine)
+        return
+    with open(quarantine + ".tmp", 'w', encoding='utf-8') as qfile:
+        json.dump(data, qfile, ensure_ascii=False, indent=2)
+    os.replace(quarantine + ".tmp", quarantine)
+
+
+def quarantined_members(zip_file, members):
+    """quarantine records for members, which are not changed after failure"""
+    ret = {}
+    for filename, record in read_quarantine(zip_file).items():
+        if members.get(filename) == record.get("member"):
+            ret[filename] = record
+    return ret
+
+
+def create_booklist(inpx_data, zip_file, incremental=False, retry=False):  # pylint: disable=C0103
+    """
+    (re)create .list from .zip, return number of books in list or None on error,
+    in incremental mode only new or changed (by crc32/size/time) members are parsed,
+    records of unchanged members are copied from existing .list,
+    members failed in previous runs are skipped until they are changed (or retry is True)
+    """
+    # pylint: disable=R0912,R0914,R0915
+    book_jobs = int(CONFIG['BOOK_JOBS'])
+    thumb_jobs = int(CONFIG['THUMB_JOBS'])
+    preview = thumb_jobs < 1  # make previews inline if no separate pool
+    count = 0
+    parsed = 0  # books written to list after parsing (not kept records)
+    blist = None
+    try:
+        manifest = zip_manifest(zip_file)
+        files = list_zip(zip_file)
+        keep = reusable_records(zip_file, manifest["members"]) if incremental else None
+        if keep is None:
+            keep = {}
+        quarantine = quarantined_members(zip_file, manifest["members"])
+        if retry:
+            for filename in read_quarantine(zip_file):
+                keep.pop(filename, None)
+            quarantine = {}
+        for filename in quarantine:
+            keep.pop(filename, None)
+        parse_files = [filename for filename in files if filename not in keep and filename not in quarantine]
+        logging.debug(
+            "%s: %s records kept, %s members to parse, %s quarantined",
+            zip_file, len(keep), len(parse_files), len(quarantine)
+        )
+        blist = BooklistWriter(zip_file, CONFIG['LIST_FORMAT'], CONFIG['COVER_SIDECAR'] == "yes")
+        inpx_meta = get_inpx_meta(inpx_data, zip_file)
+        replace_data = get_replace_list(zip_file)
+
+        if book_budget_enabled() and len(parse_files) > 0:
+            books = iter_books_supervised(
+                zip_file, parse_files, replace_data, inpx_meta, max(1, book_jobs), preview
+            )
+        elif book_jobs > 1 and len(parse_files) >= book_jobs * BOOKS_CHUNK:
+            books = iter_books_parallel(zip_file, parse_files, replace_data, inpx_meta, book_jobs, preview)
+        else:
+            books = iter_books(zip_file, parse_files, replace_data, inpx_meta, preview)
+        if not preview:
+            books = iter_previews(books, thumb_jobs)
+        for filename in files:  # .list records in .zip order
+            if filename in keep:
+                book = keep[filename]
+            elif filename in quarantine:
+                continue
+            else:
+                book = next(books)
+                if book is not None and not isinstance(book, BookFailure):
+                    parsed += 1
+            if isinstance(book, BookFailure):
+                quarantine[filename] = {"member": manifest["members"][filename], "error": book.error}
+                continue
+            if book is None:
+                continue
+            with stage("list.write"):
+                blist.write(book)
+            count += 1
+        with stage("list.write"):
+            blist.commit()
+        write_manifest(zip_file, manifest)
+        write_quarantine(zip_file, quarantine)
+        check_zip_books(zip_file, parsed)
+    except Exception as ex:  # pylint: disable=W0703
+        logging.error("error processing zip_file %s: %s", zip_file, ex)
+        if blist is not None:
+            blist.abort()
+        return None
     except KeyboardInterrupt as ex:  # Ctrl-C
-        logging.error("error processing zip_file: %s", ex)
-        logging.info("removing %s", booklist)
-        os.remove(booklist)
+        logging.error("error processing zip_file %s: %s", zip_file, ex)
+        if blist is not None:
+            blist.abort()
         sys.exit(1)
+    return count
 
 
 def booklist_up_to_date(zip_file, booklist, replacelist):
@@ -149,46 +585,202 @@ def booklist_up_to_date(zip_file, booklist, replacelist):
     return ziptime < listtime and replacetime < listtime
 
 
-def update_booklist(inpx_data, zip_file) -> bool:  # pylint: disable=C0103
-    """(re)create .list for new or updated .zip"""
+def booklist_outdated(zip_file) -> bool:
+    """
+    .list for .zip is absent or was made from other .zip content or .zip.replace,
+    content is compared with .zip.manifest, so mtime changes by copying don't matter
+    """
 
-    booklist = zip_file + ".list"
-    booklistgz = zip_file + ".list.gz"
     replacelist = zip_file + ".replace"
-
-    if os.path.exists(booklist):
-        if booklist_up_to_date(zip_file, booklist, replacelist):
-            return False
-    elif os.path.exists(booklistgz):
-        if booklist_up_to_date(zip_file, booklistgz, replacelist):
+    existing = find_booklist(zip_file)
+    if existing is None:
+        return True
+    if not booklist_supported(existing):
+        logging.info("%s is in old binary format, rebuilding", existing)
+        return True
+    manifest = read_manifest(zip_file)
+    if manifest is None:  # .list made before manifests, trust mtime once
+        if booklist_up_to_date(zip_file, existing, replacelist):
+            write_manifest(zip_file, zip_manifest(zip_file))
             return False
-        os.remove(booklistgz)  # remove outdated .list.gz, because it is not .list
+        return True
+    if manifest.get("replace") != file_sha1(replacelist):
+        return True
+    return manifest.get("members") != zip_members(zip_file)
 
-    create_booklist(inpx_data, zip_file)
+
+def update_booklist(inpx_data, zip_file) -> bool:  # pylint: disable=C0103
+    """(re)create .list for new or updated .zip, parse only new or changed books"""
+
+    if not booklist_outdated(zip_file):
+        return False
+    create_booklist(inpx_data, zip_file, incremental=True)
     return True
 
 
-def renew_lists():
-    """recreate all .list's from .zip's"""
-    logging.info("Create all lists")
+def process_zip(inpx_data, zip_file, only_new=False):
+    """
+    (re)create .list for one .zip, used as process pool task
+    return (zip_file, state, books_count, seconds), state is one of "done", "skip", "fail"
+    """
+    start = time.monotonic()
+    if only_new and not booklist_outdated(zip_file):
+        return zip_file, "skip", 0, time.monotonic() - start
+    count = create_booklist(inpx_data, zip_file, incremental=only_new)
+    state = "fail" if count is None else "done"
+    add_zip_time(zip_file, time.monotonic() - start)
+    return zip_file, state, count or 0, time.monotonic() - start
+
+
+def process_zip_task(inpx_data, zip_file, only_new=False):
+    """process_zip() in worker process, return (process_zip() result, trace data)"""
+    return process_zip(inpx_data, zip_file, only_new), take_trace()
+
+
+def log_zip_result(num, total, result):
+    """log per-zip timing"""
+    zip_file, state, count, seconds = result
+    if state == "skip":
+        logging.debug("[%s/%s] %s: up to date", num, total, zip_file)
+    elif state == "fail":
+        logging.error("[%s/%s] %s: FAILED in %.2fs", num, total, zip_file, seconds)
+    else:
+        rate = count / seconds if seconds > 0 else 0
+        logging.info("[%s/%s] %s: %s books in %.2fs (%.1f books/s)", num, total, zip_file, count, seconds, rate)
+
+
+def process_zips(only_new=False, jobs=1):
+    """(re)create .list's for all .zip's in `jobs` processes, return list of failed .zip's"""
     zipdir = CONFIG['ZIPS']
     inpx_data = zipdir + "/" + CONFIG['INPX']
-    i = 0
-    for zip_file in sorted(glob.glob(zipdir + '/*.zip')):
-        i += 1
-        logging.info("[%s] %s", (str(i)), zip_file)
-        create_booklist(inpx_data, zip_file)
+    zip_files = sorted(glob.glob(zipdir + '/*.zip'))
+    total = len(zip_files)
+    failed = []
+    start = time.monotonic()
+    load_inpx_index(inpx_data)  # build once, before worker processes start
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=reset_trace) as executor:
+            futures = {}
+            for zip_file in zip_files:
+                futures[executor.submit(process_zip_task, inpx_data, zip_file, only_new)] = zip_file
+            num = 0
+            for future in as_completed(futures):
+                num += 1
+                try:
+                    result, trace_data = future.result()
+                    merge_trace(trace_data)
+                except Exception as ex:  # pylint: disable=W0703
+                    logging.error("error processing zip_file %s: %s", futures[future], ex)
+                    result = (futures[future], "fail", 0, 0.0)
+                log_zip_result(num, total, result)
+                if result[1] == "fail":
+                    failed.append(result[0])
+    else:
+        for num, zip_file in enumerate(zip_files, start=1):
+            logging.info("[%s] %s", str(num), zip_file)
+            result = process_zip(inpx_data, zip_file, only_new)
+            log_zip_result(num, total, result)
+            if result[1] == "fail":
+                failed.append(result[0])
+    logging.info("processed %s zips in %.2fs, failed: %s", total, time.monotonic() - start, len(failed))
+    for zip_file in sorted(failed):
+        logging.error("failed: %s", zip_file)
+    return failed
+
+
+def renew_lists(jobs=1):
+    """recreate all .list's from .zip's"""
+    logging.info("Create all lists")
+    failed = process_zips(only_new=False, jobs=jobs)
     logging.info("[end]")
+    return failed
 
 
-def new_lists():
+def new_lists(jobs=1):
     """create .list's for new or updated .zip's"""
     logging.info("Create only needed lists")
+    failed = process_zips(only_new=True, jobs=jobs)
+    logging.info("[end]")
+    return failed
+
+
+def quarantine_list():
+    """log quarantined books of all .zip's, return count of them"""
+    zipdir = CONFIG['ZIPS']
+    count = 0
+    for zip_file in sorted(glob.glob(zipdir + '/*.zip')):
+        for filename, record in sorted(read_quarantine(zip_file).items()):
+            logging.info("%s/%s: %s", zip_file, filename, record.get("error"))
+            count += 1
+    logging.info("quarantined: %s", count)
+    return count
+
+
+def quarantine_retry():
+    """parse quarantined books again, return count of still failed books"""
     zipdir = CONFIG['ZIPS']
     inpx_data = zipdir + "/" + CONFIG['INPX']
-    i = 0
+    load_inpx_index(inpx_data)
     for zip_file in sorted(glob.glob(zipdir + '/*.zip')):
-        i += 1
-        logging.info("[%s] %s", (str(i)), zip_file)
-        update_booklist(inpx_data, zip_file)
-    logging.info("[end]")
+        quarantine = read_quarantine(zip_file)
+        if len(quarantine) == 0:
+            continue
+        logging.info("%s: retry %s books", zip_file, len(quarantine))
+        create_booklist(inpx_data, zip_file, incremental=True, retry=True)
+    return quarantine_list()
+
+
+def compare_parsers(z_file, zip_name: str, files, replace_data=None, inpx_meta=None):
+    """
+    parse every of `files` in opened .zip by legacy (BeautifulSoup) and streaming fb2 parsers,
+    log every different field, return count of different records
+    """
+    differ = 0
+    for filename in files:
+        try:
+            _, legacy = fb2parse(z_file, filename, replace_data, inpx_meta, legacy=True)
+        except Exception as ex:  # pylint: disable=W0703
+            logging.debug("legacy parser error in %s/%s: %s", zip_name, filename, ex)
+            legacy = None
+        try:
+            _, book = fb2parse(z_file, filename, replace_data, inpx_meta)
+        except Exception as ex:  # pylint: disable=W0703
+            logging.debug("streaming parser error in %s/%s: %s", zip_name, filename, ex)
+            book = None
+        if legacy == book:
+            continue
+        differ += 1
+        if legacy is None or book is None:
+            logging.warning("%s/%s: legacy: %s, streaming: %s", zip_name, filename, legacy, book)
+            continue
+        for key in sorted(set(legacy.keys()) | set(book.keys())):
+            if legacy.get(key) != book.get(key):
+                logging.warning(
+                    "%s/%s: '%s' legacy: %s, streaming: %s",
+                    zip_name, filename, key, legacy.get(key), book.get(key)
+                )
+    return differ
+
+
+def check_parser(limit=0):
+    """
+    compare book records made by streaming and legacy (BeautifulSoup) fb2 parsers
+    for first `limit` books (0 -- all books) of every .zip, return count of different records
+    """
+    logging.info("Compare streaming and legacy fb2 parsers")
+    zipdir = CONFIG['ZIPS']
+    inpx_data = zipdir + "/" + CONFIG['INPX']
+    checked = 0
+    differ = 0
+    for zip_file in sorted(glob.glob(zipdir + '/*.zip')):
+        logging.info("%s", zip_file)
+        inpx_meta = get_inpx_meta(inpx_data, zip_file)
+        replace_data = get_replace_list(zip_file)
+        with zipfile.ZipFile(zip_file) as z_file:
+            files = list_zip(zip_file)
+            if limit > 0:
+                files = files[:limit]
+            checked += len(files)
+            differ += compare_parsers(z_file, zip_file, files, replace_data, inpx_meta)
+    logging.info("checked %s books, different: %s", checked, differ)
+    return differ
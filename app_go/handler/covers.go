@@ -0,0 +1,132 @@
+// Package handler provides covers store lookup (store is written by datachew, see app/covers.py).
+package handler
+
+import (
+	"encoding/binary"
+	"encoding/hex"
+	"encoding/json"
+	"io"
+	"os"
+	"path/filepath"
+	"sync"
+)
+
+const (
+	// coverPackBucket is length of cover_id prefix, which selects covers/<aa>.pack
+	coverPackBucket = 2
+	// coverIndexRecSize is size of .idx record: md5 digest, uint64 offset, uint32 length (little endian)
+	coverIndexRecSize = 16 + 8 + 4
+)
+
+// coverPack is in-memory index of one bucket, updated from .idx tail (index is append-only).
+type coverPack struct {
+	index   map[string][2]int64 // cover_id -> offset, length in .pack
+	idxSize int64
+}
+
+var (
+	coverPacks   = map[string]*coverPack{}
+	coverPacksMu sync.Mutex
+)
+
+// bookCoverID returns cover_id from book .json or "".
+func bookCoverID(bookJSON string) string {
+	data, err := os.ReadFile(bookJSON)
+	if err != nil {
+		return ""
+	}
+	var book struct {
+		CoverID string `json:"cover_id"`
+	}
+	if err := json.Unmarshal(data, &book); err != nil {
+		return ""
+	}
+	if _, err := hex.DecodeString(book.CoverID); err != nil || len(book.CoverID) != 32 {
+		return ""
+	}
+	return book.CoverID
+}
+
+// coverStorePath returns path of loose cover file in store.
+func coverStorePath(pagesDir, coverID string) string {
+	return filepath.Join(pagesDir, "covers", coverID[:2], coverID[2:4], coverID+".jpg")
+}
+
+// loadCoverPack returns index of bucket with records appended since last call, nil if there is no pack.
+func loadCoverPack(pagesDir, bucket string) *coverPack {
+	idxFile := filepath.Join(pagesDir, "covers", bucket+".idx")
+	st, err := os.Stat(idxFile)
+	if err != nil {
+		return nil
+	}
+	idxSize := st.Size() - st.Size()%coverIndexRecSize // record may be written just now
+	pack, ok := coverPacks[bucket]
+	if !ok {
+		pack = &coverPack{index: map[string][2]int64{}}
+		coverPacks[bucket] = pack
+	}
+	if idxSize > pack.idxSize {
+		f, err := os.Open(idxFile)
+		if err != nil {
+			return pack
+		}
+		defer f.Close()
+		data := make([]byte, idxSize-pack.idxSize)
+		if _, err := f.ReadAt(data, pack.idxSize); err != nil && err != io.EOF {
+			return pack
+		}
+		for pos := 0; pos+coverIndexRecSize <= len(data); pos += coverIndexRecSize {
+			rec := data[pos : pos+coverIndexRecSize]
+			pack.index[hex.EncodeToString(rec[:16])] = [2]int64{
+				int64(binary.LittleEndian.Uint64(rec[16:24])),
+				int64(binary.LittleEndian.Uint32(rec[24:28])),
+			}
+		}
+		pack.idxSize = idxSize
+	}
+	return pack
+}
+
+// readPackedCover returns image bytes from covers/<aa>.pack or nil.
+func readPackedCover(pagesDir, coverID string) []byte {
+	bucket := coverID[:coverPackBucket]
+	coverPacksMu.Lock()
+	pack := loadCoverPack(pagesDir, bucket)
+	var rec [2]int64
+	found := false
+	if pack != nil {
+		rec, found = pack.index[coverID]
+	}
+	coverPacksMu.Unlock()
+	if !found {
+		return nil
+	}
+	f, err := os.Open(filepath.Join(pagesDir, "covers", bucket+".pack"))
+	if err != nil {
+		return nil
+	}
+	defer f.Close()
+	data := make([]byte, rec[1])
+	if _, err := f.ReadAt(data, rec[0]); err != nil {
+		return nil
+	}
+	return data
+}
+
+// findCover returns etag and file path or image bytes of book cover:
+// from store by cover_id in book .json (loose file or pack), or legacy <book_id>.jpg near it.
+func findCover(pagesDir, bookBase, bookID string) (string, string, []byte, bool) {
+	if coverID := bookCoverID(bookBase + ".json"); coverID != "" {
+		path := coverStorePath(pagesDir, coverID)
+		if _, err := os.Stat(path); err == nil {
+			return coverID, path, nil, true
+		}
+		if data := readPackedCover(pagesDir, coverID); data != nil {
+			return coverID, "", data, true
+		}
+	}
+	if _, err := os.Stat(bookBase + ".jpg"); err == nil {
+		return bookID, bookBase + ".jpg", nil, true
+	}
+	return "", "", nil, false
+}
@@ -13,6 +13,7 @@ import (
 	"path/filepath"
 	"strings"
 	tmplx "text/template"
+	"time"
 
 	"fb2srv_go/config"
 	"fb2srv_go/util"
@@ -38,17 +39,15 @@ func (s *Server) coverHandler(w http.ResponseWriter, r *http.Request) {
 
 	pagesDir := s.CFG.Get("PAGES")
 
-	// Build cover path: /books/{sub1}/{sub2}/{book_id}.jpg
-	coverFile := fmt.Sprintf("/books/%s/%s/%s.jpg", sub1, sub2, bookID)
+	// Build book path: /books/{sub1}/{sub2}/{book_id} (.json refers cover in store, .jpg is legacy cover)
+	bookFile := fmt.Sprintf("/books/%s/%s/%s", sub1, sub2, bookID)
 
 	// safe_path equivalent: ensure path is safe
-	coverFile = strings.ReplaceAll(coverFile, "..", "")
-	coverFile = strings.TrimPrefix(coverFile, "/")
+	bookFile = strings.ReplaceAll(bookFile, "..", "")
+	bookFile = strings.TrimPrefix(bookFile, "/")
 
-	fullPath := filepath.Join(pagesDir, coverFile)
-
-	// Check if file exists
-	if _, err := os.Stat(fullPath); os.IsNotExist(err) {
+	etag, fullPath, data, ok := findCover(pagesDir, filepath.Join(pagesDir, bookFile), bookID)
+	if !ok {
 		// Fallback to default cover
 		s.serveDefaultCover(w, r)
 		return
@@ -58,6 +57,13 @@ func (s *Server) coverHandler(w http.ResponseWriter, r *http.Request) {
 	fmt.Sscanf(s.CFG.Get("CACHE_TIME_ST"), "%d", &maxAge)
 
 	w.Header().Set("Cache-Control", fmt.Sprintf("max-age=%d, must-revalidate", maxAge))
+	w.Header().Set("ETag", `"`+etag+`"`)
+	if data != nil {
+		// packed cover, ServeContent handles If-None-Match by ETag
+		w.Header().Set("Content-Type", "image/jpeg")
+		http.ServeContent(w, r, bookID+".jpg", time.Time{}, bytes.NewReader(data))
+		return
+	}
 	http.ServeFile(w, r, fullPath)
 }
 
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""indexer hot path micro-benchmarks on synthetic fb2 corpus (run as `python3 -m bench`)"""
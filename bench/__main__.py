@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""python3 -m bench [-k filter] [-o result.json] [-b baseline.json] [--max-ratio 1.2] | --check-parsers"""
+
+import sys
+import argparse
+import logging
+
+from .run import REPEAT, run_benchmarks, compare, load_json, save_json
+from .parsers import check_parsers
+
+
+def parse_arguments():
+    """argument parser"""
+    parser = argparse.ArgumentParser(description="indexer micro-benchmarks on synthetic fb2 corpus")
+    parser.add_argument('-k', '--filter', type=str, default=None,
+                        help='run only benchmarks with substring in name')
+    parser.add_argument('-r', '--repeat', type=int, default=REPEAT,
+                        help=f'runs of every benchmark (default: {REPEAT})')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='save results as json (i.e. new baseline)')
+    parser.add_argument('-b', '--baseline', type=str, default=None,
+                        help='compare results with saved json')
+    parser.add_argument('--max-ratio', type=float, default=None,
+                        help='exit with code 1 if any benchmark is slower than baseline * ratio')
+    parser.add_argument('--check-parsers', action='store_true',
+                        help='compare legacy and streaming fb2 parsers on corpus, exit with code 1 on any difference')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.check_parsers:
+        logging.basicConfig(level=logging.WARNING)
+        if check_parsers():
+            sys.exit(1)
+        sys.exit(0)
+    logging.basicConfig(level=logging.CRITICAL)  # broken data errors are expected
+    results = run_benchmarks(args.filter, args.repeat)
+    if args.output is not None:
+        save_json(args.output, results)
+    if args.baseline is not None:
+        if compare(results, load_json(args.baseline), args.max_ratio):
+            sys.exit(1)
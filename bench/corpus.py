@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""synthetic fb2 corpus: every case is deterministic, so results of runs are comparable"""
+
+import io
+import base64
+import zipfile
+
+from PIL import Image
+
+FB2_XMLNS = 'xmlns="http://www.gribuser.ru/xml/fictionbook/2.0" xmlns:l="http://www.w3.org/1999/xlink"'
+FB2_XMLNS_PREFIXED = 'xmlns:fb="http://www.gribuser.ru/xml/fictionbook/2.0" xmlns:l="http://www.w3.org/1999/xlink"'
+BODY_PARAGRAPHS = 2000  # ~100KB of text, typical for novel is 10x more
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    """deterministic jpeg image (gradient)"""
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def make_png(width: int, height: int) -> bytes:
+    """deterministic png image"""
+    img = Image.radial_gradient("L").resize((width, height))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def b64(data: bytes) -> str:
+    """base64 as in fb2 <binary>, with line breaks"""
+    text = base64.b64encode(data).decode("ascii")
+    return "\n".join(text[pos:pos + 76] for pos in range(0, len(text), 76))
+
+
+def make_fb2(
+    title="Тестовая книга", encoding="utf-8", prefixed=False,
+    cover=None, sequences='<sequence name="Серия" number="1"/>'
+) -> bytes:
+    """fb2 document, cover is jpeg bytes or str (already encoded, maybe broken) or None"""
+    # pylint: disable=R0913
+    covertag = '<coverpage><image l:href="#cover.jpg"/></coverpage>' if cover is not None else ''
+    binaries = '<binary id="pic.png" content-type="image/png">%s</binary>' % b64(make_png(64, 64))
+    if cover is not None:
+        data = cover if isinstance(cover, str) else b64(cover)
+        binaries += '<binary id="cover.jpg" content-type="image/jpeg">%s</binary>' % data
+    body = "<body><title><p>%s</p></title><section>%s</section></body>" % (
+        title,
+        "".join(
+            "<p>Абзац %s текста книги с <emphasis>выделением</emphasis> и <strong>жирным</strong>.</p>" % num
+            for num in range(BODY_PARAGRAPHS)
+        )
+    )
+    doc = (
+        '<?xml version="1.0" encoding="%s"?>\n'
+        '<FictionBook %s><description><title-info>'
+        '<genre>sf</genre><genre>sf_space</genre>'
+        '<author><first-name>Иван</first-name><middle-name>Иванович</middle-name>'
+        '<last-name>Иванов</last-name></author>'
+        '<author><nickname>Псевдоним</nickname></author>'
+        '<book-title>%s</book-title>'
+        '<annotation><p>Аннотация &amp; описание</p><p>Вторая <emphasis>строка</emphasis></p></annotation>'
+        '<date>2001</date><lang>ru</lang>%s%s</title-info>'
+        '<document-info><author><nickname>doc</nickname></author><id>bench-%s</id></document-info>'
+        '<publish-info><publisher>Издательство</publisher><year>2001</year><isbn>978-5-00000-000-0</isbn>'
+        '</publish-info></description>%s%s</FictionBook>'
+    ) % (encoding, FB2_XMLNS, title, covertag, sequences, sum(map(ord, title)) % 1000, body, binaries)
+    if prefixed:
+        doc = doc.replace("<FictionBook " + FB2_XMLNS, "<fb:FictionBook " + FB2_XMLNS_PREFIXED)
+        doc = doc.replace("</FictionBook>", "</fb:FictionBook>")
+    return doc.encode(encoding)
+
+
+def corpus_cases():
+    """return {filename: fb2 bytes} of benchmark cases"""
+    small_cover = make_jpeg(300, 450)
+    return {
+        "plain.fb2": make_fb2(title="Простая книга", cover=small_cover),
+        "namespaced.fb2": make_fb2(title="Книга с префиксом", prefixed=True, cover=small_cover),
+        "cp1251.fb2": make_fb2(title="Книга в cp1251", encoding="windows-1251", cover=small_cover),
+        "big_cover.fb2": make_fb2(title="Большая обложка", cover=make_jpeg(2400, 3600)),
+        "nested_seq.fb2": make_fb2(
+            title="Вложенные серии",
+            cover=small_cover,
+            sequences=(
+                '<sequence name="Мир" number="1"><sequence name="Цикл" number="2">'
+                '<sequence name="Подцикл" number="3"/></sequence></sequence>'
+                '<sequence name="Другая серия" number="5"/>'
+            )
+        ),
+        "broken_b64.fb2": make_fb2(title="Битая обложка", cover="/9j/4AAQSkZJRgAB!!!@@@===broken==="),
+        "no_cover.fb2": make_fb2(title="Без обложки"),
+    }
+
+
+def make_corpus_zip(zip_file: str):
+    """write corpus cases to .zip, return list of members"""
+    cases = corpus_cases()
+    with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED) as z_file:
+        for filename, data in cases.items():
+            # fixed member time, so book records do not depend on generation time
+            z_file.writestr(zipfile.ZipInfo(filename, (2020, 1, 1, 0, 0, 0)), data, zipfile.ZIP_DEFLATED)
+    return list(cases)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""compare legacy (BeautifulSoup) and streaming fb2 parsers on synthetic corpus"""
+
+import os
+import logging
+import tempfile
+import zipfile
+
+from app.config import CONFIG
+from app.fb2int import fb2parse
+from app.zips import compare_parsers
+
+from .corpus import make_corpus_zip
+
+
+def check_parsers():
+    """return count of corpus cases with different (or missing) records from legacy and streaming parsers"""
+    CONFIG.setdefault("PIC_WIDTH", "200")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        zip_file = os.path.join(tmpdir, "corpus.zip")
+        files = make_corpus_zip(zip_file)
+        with zipfile.ZipFile(zip_file) as z_file:
+            differ = compare_parsers(z_file, "corpus.zip", files)
+            for filename in files:
+                # both parsers failing is not a difference, but corpus case must give record
+                try:
+                    _, book = fb2parse(z_file, filename, None, None)
+                except Exception as ex:  # pylint: disable=W0703
+                    logging.warning("corpus.zip/%s: streaming parser error: %s", filename, ex)
+                    book = None
+                if book is None:
+                    logging.warning("corpus.zip/%s: no book record", filename)
+                    differ += 1
+    print("parsers: checked %s cases, different: %s" % (len(files), differ))
+    return differ
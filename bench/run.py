@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""benchmarks of indexer functions with fixed iteration counts and json results"""
+
+import os
+import copy
+import json
+import time
+import tempfile
+import zipfile
+import statistics
+
+from app.config import CONFIG
+from app.strings import make_id
+from app.data import refine_book
+from app.fb2int import fb2parse, get_image, get_author_struct, THUMBS_CACHE
+
+from .corpus import corpus_cases, make_corpus_zip, make_jpeg, b64
+
+REPEAT = 5  # runs of every benchmark, best and median of them are reported
+FB2PARSE_ITERATIONS = 20
+BIG_COVER_ITERATIONS = 3
+IMAGE_ITERATIONS = 10
+SMALL_ITERATIONS = 20000  # for fast pure python functions
+
+AUTHORS = [
+    {"first-name": "Иван", "middle-name": "Иванович", "last-name": "Иванов"},
+    {"first-name": "John", "last-name": "Smith", "nickname": "js"},
+    {"nickname": "Псевдоним"},
+]
+BOOK_NAME = "Очень длинное название книги, с «кавычками» и ё-буквой — серия 12"
+
+
+def measure(func, iterations: int, repeat: int = REPEAT):
+    """run func iterations times in every of repeat runs, return timings per iteration in ms"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        times.append((time.perf_counter() - start) / iterations * 1000)
+    return {
+        "iterations": iterations,
+        "repeat": repeat,
+        "best_ms": round(min(times), 4),
+        "median_ms": round(statistics.median(times), 4)
+    }
+
+
+def fb2parse_bench(z_file, filename):
+    """fb2parse() of one member without preview cache"""
+    def run():
+        THUMBS_CACHE.clear()
+        fb2parse(z_file, filename, None, None)
+    return run
+
+
+def get_image_bench(binary):
+    """get_image() with preview making, without preview cache"""
+    def run():
+        THUMBS_CACHE.clear()
+        get_image("cover.jpg", binary)
+    return run
+
+
+def refine_book_bench(book):
+    """refine_book() on copy of parsed record"""
+    def run():
+        refine_book(copy.deepcopy(book))
+    return run
+
+
+def make_benchmarks(z_file):
+    """return [(name, func, iterations), ...]"""
+    ret = []
+    for filename in z_file.namelist():
+        iterations = BIG_COVER_ITERATIONS if filename == "big_cover.fb2" else FB2PARSE_ITERATIONS
+        ret.append(("fb2parse/" + filename[:-4], fb2parse_bench(z_file, filename), iterations))
+    images = {
+        "small": make_jpeg(300, 450),
+        "big": make_jpeg(2400, 3600),
+    }
+    for name, data in images.items():
+        binary = [
+            {"@id": "pic.png", "@content-type": "image/png", "#text": "iVBORw0KGgo="},
+            {"@id": "cover.jpg", "@content-type": "image/jpeg", "#text": b64(data)}
+        ]
+        iterations = BIG_COVER_ITERATIONS if name == "big" else IMAGE_ITERATIONS
+        ret.append(("get_image/" + name, get_image_bench(binary), iterations))
+    broken = {"@id": "cover.jpg", "@content-type": "image/jpeg", "#text": "/9j/4AAQ!!!broken"}
+    ret.append(("get_image/broken_b64", get_image_bench(broken), IMAGE_ITERATIONS))
+    ret.append(("get_author_struct", lambda: get_author_struct(AUTHORS), SMALL_ITERATIONS // 10))
+    ret.append(("make_id", lambda: make_id(BOOK_NAME), SMALL_ITERATIONS))
+    _, book = fb2parse(z_file, "plain.fb2", None, None)
+    ret.append(("refine_book", refine_book_bench(book), SMALL_ITERATIONS // 10))
+    return ret
+
+
+def run_benchmarks(name_filter=None, repeat=REPEAT):
+    """run benchmarks (with name_filter substring in name), return results struct"""
+    CONFIG.setdefault("PIC_WIDTH", "200")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        zip_file = os.path.join(tmpdir, "bench.zip")
+        make_corpus_zip(zip_file)
+        with zipfile.ZipFile(zip_file) as z_file:
+            for name, func, iterations in make_benchmarks(z_file):
+                if name_filter is not None and name_filter not in name:
+                    continue
+                func()  # warm up
+                results[name] = measure(func, iterations, repeat)
+                print("%-28s %10.4f ms  (best %.4f ms)" % (name, results[name]["median_ms"], results[name]["best_ms"]))
+    return {
+        "pic_width": CONFIG["PIC_WIDTH"],
+        "cases": sorted(corpus_cases()),
+        "results": results
+    }
+
+
+def compare(results, baseline, max_ratio=None):
+    """print median ratios to baseline, return names of benchmarks slower than max_ratio"""
+    slower = []
+    print("%-28s %12s %12s %8s" % ("benchmark", "baseline ms", "current ms", "ratio"))
+    for name, res in results["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None or base["median_ms"] == 0:
+            print("%-28s %12s %12.4f %8s" % (name, "-", res["median_ms"], "-"))
+            continue
+        ratio = res["median_ms"] / base["median_ms"]
+        print("%-28s %12.4f %12.4f %8.2f" % (name, base["median_ms"], res["median_ms"], ratio))
+        if max_ratio is not None and ratio > max_ratio:
+            slower.append(name)
+    return slower
+
+
+def load_json(filename):
+    """load json file"""
+    with open(filename, encoding="utf-8") as data:
+        return json.load(data)
+
+
+def save_json(filename, data):
+    """save json file"""
+    with open(filename, "w", encoding="utf-8") as out:
+        json.dump(data, out, indent=2, ensure_ascii=False)
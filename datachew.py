@@ -7,9 +7,14 @@ import argparse
 import sys
 
 from app.config import read_config, CONFIG
-from app.zips import renew_lists, new_lists
+from app.zips import renew_lists, new_lists, check_parser, quarantine_list, quarantine_retry
+from app.booklist import BOOKLIST_FORMATS, convert_lists, bench_lists
+from app.trace import trace_enable, trace_write, command
+from app.covers import pack_covers
 from app.db import dbtables, dbclean
 from app.db_fill import process_booklists_db, make_vectors
+from app.db_sync import process_booklists_sync
+from app.db_bulk import deferred_indexes, FILL_TABLES, VECTORS_TABLES
 from app.files_fill import (
     make_book_struct,
     make_authorsindex,
@@ -20,21 +25,52 @@ from app.files_fill import (
 CONFIG_FILE = "./config.ini"
 
 
+def add_jobs_argument(subparser):
+    """add --jobs option to lists processing commands"""
+    subparser.add_argument('-j', '--jobs', type=int, default=1,
+                           help='process N .zip files in parallel (default: 1)')
+    subparser.add_argument('-b', '--book-jobs', type=int, default=None,
+                           help='parse books of single .zip in N processes (default: book_jobs from config or 1)')
+
+
 def parse_arguments():
     """argument parser func"""
     parser = argparse.ArgumentParser(description="fb2 in zips processing")
     parser.add_argument('-c', '--config', type=str, default=CONFIG_FILE,
                         help=f'config filename (default: {CONFIG_FILE})')
+    parser.add_argument('-t', '--trace', type=str, default=None,
+                        help='write json report with stages timings and throughput to file')
 
     subparsers = parser.add_subparsers(dest='command', help='Commands')
 
     lists_parser = subparsers.add_parser('lists',
                                          help='[re]create all .zip.list')
     lists_parser.description = '[re]create all .zip.list'
+    add_jobs_argument(lists_parser)
 
     new_lists_parser = subparsers.add_parser('new_lists',
                                              help='[re]create .zip.list for only new/refreshed .zip')
     new_lists_parser.description = '[re]create .zip.list for only new/refreshed .zip'
+    add_jobs_argument(new_lists_parser)
+
+    check_parser_parser = subparsers.add_parser('checkparser',
+                                                help='Compare streaming and legacy fb2 parsers on .zip content')
+    check_parser_parser.description = 'Compare book records from streaming and legacy (BeautifulSoup) fb2 parsers'
+    check_parser_parser.add_argument('-l', '--limit', type=int, default=0,
+                                     help='check only first N books of every .zip (default: 0 -- all books)')
+
+    quarantine_parser = subparsers.add_parser('quarantine', help='List (or retry) books failed in parsing')
+    quarantine_parser.description = 'List books, which are skipped in indexing until changed, because of parsing errors'
+    quarantine_parser.add_argument('-r', '--retry', action='store_true',
+                                   help='parse quarantined books again and add them to .zip.list on success')
+
+    convert_lists_parser = subparsers.add_parser('convertlists', help='Convert all booklists to other format')
+    convert_lists_parser.description = 'Convert all .zip.list* to jsonl (.zip.list) or binary (.zip.list.bin) format'
+    convert_lists_parser.add_argument('-f', '--format', choices=sorted(BOOKLIST_FORMATS), default='bin',
+                                      help='target format (default: bin)')
+
+    bench_lists_parser = subparsers.add_parser('benchlists', help='Compare booklist formats load time and size')
+    bench_lists_parser.description = 'Convert booklists to every format in temporary dir, compare load time and size'
 
     clean_db_parser = subparsers.add_parser('cleandb', help='Clean database tables and other if need')
     clean_db_parser.description = 'Clean database tables and other if need'
@@ -42,15 +78,24 @@ def parse_arguments():
     make_db_parser = subparsers.add_parser('tables', help='Create database tables and other if need')
     make_db_parser.description = 'Create database tables and other if need'
 
-    # fillall_db_parser = subparsers.add_parser('fillall', help='Fill all .zip.list to database, update if exists')
-    # fillall_db_parser.description = 'Fill all .zip.list to database, update if exists'
+    fillall_db_parser = subparsers.add_parser('fillall', help='Fill all .zip.list to database, update if exists')
+    fillall_db_parser.description = 'Sync database with all .zip.list: update changed, delete vanished books'
 
-    fillonly_db_parser = subparsers.add_parser('fillonly', help='Fill all .zip.list to database, update if exists')
+    fillonly_db_parser = subparsers.add_parser('fillonly', help='Fill all .zip.list to database, skip if exists')
     fillonly_db_parser.description = 'Fill all .zip.list to database, skip if exists'
+    fillonly_db_parser.add_argument('--bulk', action='store_true',
+                                    help='load by COPY to staging tables and merge (fast initial load)')
+    fillonly_db_parser.add_argument('-j', '--jobs', type=int, default=1,
+                                    help='fill N booklists in parallel, every process with own connection (default: 1)')
+    fillonly_db_parser.add_argument('--defer-indexes', action='store_true',
+                                    help='drop search indexes while filling and rebuild them after (initial load)')
 
     cover_parser = subparsers.add_parser('books', help='Make static data for books/covers')
     cover_parser.description = 'Make static data for book/covers'
 
+    pack_covers_parser = subparsers.add_parser('packcovers', help='Move loose cover files to packs')
+    pack_covers_parser.description = 'Move covers from file per image store to covers/<aa>.pack (cover_store = pack)'
+
     authindex_parser = subparsers.add_parser('authors', help='Make static json struct for authors')
     authindex_parser.description = 'Make static json struct for authors'
 
@@ -65,54 +110,99 @@ def parse_arguments():
         help='Run new_lists fillonly books authors sequences genres sequentially'
     )
     allindex_parser.description = 'Run new_lists fillonly books authors sequences genres sequentially'
+    add_jobs_argument(allindex_parser)
 
     vectors_parser = subparsers.add_parser('vectors', help='[optional] Make vector data in db for vector search')
     vectors_parser.description = 'Make vector data in db for vector search -- only if vector_search is set in config'
+    vectors_parser.add_argument('--defer-indexes', action='store_true',
+                                help='drop search indexes while filling and rebuild them after')
 
     pargs = parser.parse_args()
     return pargs
 
 
-if __name__ == "__main__":
-    args = parse_arguments()
-
-    read_config(args.config)
-
-    if CONFIG['DEBUG'] == 'yes' or CONFIG['DEBUG'] is True:
-        DBLOGLEVEL = logging.DEBUG  # DEBUG, INFO, WARN, ERR
-    else:
-        DBLOGLEVEL = logging.INFO  # INFO, WARN, ERR
-    DBLOGFORMAT = '%(asctime)s -- %(message)s'
-    logging.basicConfig(level=DBLOGLEVEL, format=DBLOGFORMAT)
-
+def run_command(args):  # pylint: disable=R0912
+    """run datachew command"""
     if args.command == 'lists':
-        renew_lists()
+        if renew_lists(jobs=args.jobs):
+            sys.exit(1)
     elif args.command == 'new_lists':
-        new_lists()
+        if new_lists(jobs=args.jobs):
+            sys.exit(1)
+    elif args.command == 'checkparser':
+        if check_parser(limit=args.limit):
+            sys.exit(1)
+    elif args.command == 'quarantine':
+        if args.retry:
+            quarantine_retry()
+        else:
+            quarantine_list()
+    elif args.command == 'convertlists':
+        convert_lists(args.format)
+    elif args.command == 'benchlists':
+        bench_lists()
     elif args.command == 'tables':
         dbtables()
     elif args.command == 'cleandb':
         dbclean()
+    elif args.command == 'fillall':
+        process_booklists_sync()
     elif args.command == 'fillonly':
-        process_booklists_db()
+        with deferred_indexes(FILL_TABLES, args.defer_indexes) as deferred:
+            process_booklists_db(bulk=args.bulk, jobs=args.jobs, deferred=deferred)
     elif args.command == 'authors':
         make_authorsindex()
     elif args.command == 'books':
         make_book_struct()
+    elif args.command == 'packcovers':
+        pack_covers(CONFIG['PAGES'])
     elif args.command == 'sequences':
         make_sequencesindex()
     elif args.command == 'genres':
         make_genresindex()
     elif args.command == 'all':
-        new_lists()
-        dbtables()
-        process_booklists_db()
-        make_book_struct()
-        make_authorsindex()
-        make_sequencesindex()
-        make_genresindex()
+        with command('new_lists'):
+            new_lists(jobs=args.jobs)
+        with command('tables'):
+            dbtables()
+        with command('fillonly'):
+            process_booklists_db()
+        with command('books'):
+            make_book_struct()
+        with command('authors'):
+            make_authorsindex()
+        with command('sequences'):
+            make_sequencesindex()
+        with command('genres'):
+            make_genresindex()
     elif args.command == 'vectors':
-        make_vectors()
+        with deferred_indexes(VECTORS_TABLES, args.defer_indexes) as deferred:
+            make_vectors(deferred)
     else:
         print("-h or --help for help")
         sys.exit(1)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    read_config(args.config)
+
+    if CONFIG['DEBUG'] == 'yes' or CONFIG['DEBUG'] is True:
+        DBLOGLEVEL = logging.DEBUG  # DEBUG, INFO, WARN, ERR
+    else:
+        DBLOGLEVEL = logging.INFO  # INFO, WARN, ERR
+    DBLOGFORMAT = '%(asctime)s -- %(message)s'
+    logging.basicConfig(level=DBLOGLEVEL, format=DBLOGFORMAT)
+
+    if getattr(args, 'book_jobs', None) is not None:
+        CONFIG['BOOK_JOBS'] = str(args.book_jobs)
+
+    if args.trace is not None:
+        trace_enable()
+    try:
+        with command(str(args.command)):
+            run_command(args)
+    finally:
+        if args.trace is not None:
+            trace_write(args.trace)